@@ -5,11 +5,19 @@ with open('README.rst') as f:
 
 INSTALL_REQUIRES = [
       'google-api-core>=1.26.3',
-      'google-cloud-storage>=1.37.1',
+      'google-cloud-storage>=1.44.0',
+      'google-crc32c>=1.0.0',
       'google-cloud-automl>=2.3.0',
       'google-cloud-bigquery>=2.14.0'
 ]
 
+EXTRAS_REQUIRE = {
+      'async': ['aiohttp>=3.7'],
+      'zstd': ['zstandard>=0.15'],
+      'orjson': ['orjson>=3.0'],
+      'images': ['Pillow>=8.0']
+}
+
 setup(
     name='txpy-gchelper',
     version='0.0.14',
@@ -21,6 +29,7 @@ setup(
     url='https://github.com/tyxio/txpy-gchelper',
     license='MIT License',
     install_requires=INSTALL_REQUIRES,
+    extras_require=EXTRAS_REQUIRE,
     packages=find_packages(exclude=('tests', 'docs')),
     classifiers=[
         "Programming Language :: Python :: 3",
@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+from txpy.gchelper.storage.cache import DiskCache
+
+def content(data):
+    return lambda f: f.write(data)
+
+def cached_bytes(directory):
+    return sum(
+        os.path.getsize(os.path.join(root, file_name))
+        for root, _, file_names in os.walk(directory)
+        for file_name in file_names if not file_name.startswith('.'))
+
+def test_put_then_open(tmp_path):
+
+    cache = DiskCache(str(tmp_path))
+    assert cache.open('b', 'x', 1) is None
+
+    path = cache.put('b', 'x', 1, content(b'data'))
+    assert path == cache.path('b', 'x', 1)
+    with cache.open('b', 'x', 1) as f:
+        assert f.read() == b'data'
+
+def test_failed_download_leaves_no_entry(tmp_path):
+
+    def download(f):
+        f.write(b'partial')
+        raise IOError('broken')
+
+    cache = DiskCache(str(tmp_path))
+    with pytest.raises(IOError):
+        cache.put('b', 'x', 1, download)
+
+    assert cache.open('b', 'x', 1) is None
+    assert cached_bytes(str(tmp_path)) == 0
+
+def test_new_generation_replaces_the_old_one(tmp_path):
+
+    cache = DiskCache(str(tmp_path))
+    old_path = cache.put('b', 'x', 1, content(b'old'))
+    cache.put('b', 'x', 2, content(b'newer'))
+
+    assert not os.path.exists(old_path)
+    assert cache.open('b', 'x', 1) is None
+    assert cache._read_total() == cached_bytes(str(tmp_path)) == 5
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+
+    cache = DiskCache(str(tmp_path), max_bytes=1000)
+    for i in range(30):
+        path = cache.put('b', f"x{i}", 1, content(b'x' * 100))
+        # explicit mtimes, the file system resolution could tie them
+        os.utime(path, (i, i))
+
+    assert cached_bytes(str(tmp_path)) <= 1000
+    assert cache._read_total() == cached_bytes(str(tmp_path))
+    assert cache.open('b', 'x0', 1) is None
+    with cache.open('b', 'x29', 1) as f:
+        assert f.read() == b'x' * 100
+
+def test_puts_below_max_bytes_do_not_scan(tmp_path):
+
+    cache = DiskCache(str(tmp_path), max_bytes=100000)
+    scans = list()
+    evict_locked = cache._evict_locked
+    cache._evict_locked = lambda: scans.append(1) or evict_locked()
+
+    for i in range(100):
+        cache.put('b', f"x{i}", 1, content(b'x' * 10))
+
+    # only the first put, which finds no running total
+    assert len(scans) == 1
+    assert cache._read_total() == cached_bytes(str(tmp_path)) == 1000
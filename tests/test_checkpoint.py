@@ -0,0 +1,49 @@
+from types import SimpleNamespace
+
+from txpy.gchelper.vision.checkpoint import OcrCheckpoint
+
+def image(name, generation):
+    return SimpleNamespace(name=name, generation=generation)
+
+def test_checkpoint_round_trip(tmp_path):
+
+    path = str(tmp_path / 'checkpoint.json')
+    checkpoint = OcrCheckpoint(path)
+    blobs = list(checkpoint.filter([image('a.png', 1), image('b.png', 1), image('c.png', 1)]))
+    assert [blob.name for blob in blobs] == ['a.png', 'b.png', 'c.png']
+
+    # c.png failed and is not recorded
+    checkpoint.mark_done('a.png')
+    checkpoint.mark_done('b.png')
+    checkpoint.save()
+
+    rerun = OcrCheckpoint(path)
+    blobs = list(rerun.filter([image('a.png', 1), image('b.png', 2), image('c.png', 1), image('d.png', 1)]))
+    assert [blob.name for blob in blobs] == ['b.png', 'c.png', 'd.png']
+    assert rerun.skipped == 1
+
+def test_checkpoint_saves_every_save_interval(tmp_path):
+
+    path = tmp_path / 'checkpoint.json'
+    saves = list()
+    checkpoint = OcrCheckpoint(str(path), save_interval=2, before_save=lambda: saves.append(1))
+    list(checkpoint.filter([image('a.png', 1), image('b.png', 1), image('c.png', 1)]))
+
+    checkpoint.mark_done('a.png')
+    assert not path.exists()
+
+    checkpoint.mark_done('b.png')
+    assert len(saves) == 1
+    assert OcrCheckpoint(str(path)).entries == {'a.png': 1, 'b.png': 1}
+
+def test_only_filtered_blobs_are_recorded(tmp_path):
+
+    checkpoint = OcrCheckpoint(str(tmp_path / 'checkpoint.json'))
+    checkpoint.mark_done('unknown.png')
+    assert checkpoint.entries == {}
+
+def test_corrupt_checkpoint_is_ignored(tmp_path):
+
+    path = tmp_path / 'checkpoint.json'
+    path.write_text('{not json')
+    assert OcrCheckpoint(str(path)).entries == {}
@@ -0,0 +1,67 @@
+import io
+
+from types import SimpleNamespace
+
+import pytest
+
+from txpy.gchelper.storage import codecs
+
+class _Raw(io.BytesIO):
+    '''
+    BytesIO keeping its content once closed.
+    '''
+
+    def close(self):
+        self.content = self.getvalue()
+        super().close()
+
+def available_codecs():
+
+    yield codecs.GZIP
+    try:
+        import zstandard
+        yield codecs.ZSTD
+    except ImportError:
+        pass
+
+@pytest.mark.parametrize('codec', list(available_codecs()))
+def test_compress_round_trip(codec):
+
+    data = b'some text ' * 1000
+    compressed = codecs.compress(data, codec)
+    assert len(compressed) < len(data)
+    assert codecs.decompress(compressed, codec) == data
+
+@pytest.mark.parametrize('codec', list(available_codecs()))
+def test_streaming_round_trip(codec):
+
+    raw = _Raw()
+    writer = codecs.compressing_writer(raw, codec)
+    for i in range(100):
+        writer.write(f"line {i}\n".encode('utf-8'))
+    writer.close()
+    assert raw.closed
+
+    reader = codecs.decompressing_reader(_Raw(raw.content), codec)
+    assert reader.read() == b''.join(f"line {i}\n".encode('utf-8') for i in range(100))
+    reader.close()
+
+def test_unknown_codec_is_rejected():
+
+    with pytest.raises(ValueError):
+        codecs.compress(b'data', 'lz4')
+
+def test_gzip_blobs_get_a_content_encoding():
+
+    blob = SimpleNamespace(metadata={'owner': 'me'}, content_encoding=None)
+    codecs.set_codec(blob, codecs.GZIP)
+
+    assert blob.content_encoding == codecs.GZIP
+    assert blob.metadata == {'owner': 'me', codecs.CODEC_METADATA_KEY: codecs.GZIP}
+    assert codecs.get_codec(blob) == codecs.GZIP
+
+def test_codec_of_plain_blobs():
+
+    assert codecs.get_codec(SimpleNamespace(metadata=None, content_encoding=None)) is None
+    # gzip blobs uploaded by other tools only have the content encoding
+    assert codecs.get_codec(SimpleNamespace(metadata=None, content_encoding='gzip')) == codecs.GZIP
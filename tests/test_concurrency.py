@@ -0,0 +1,47 @@
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from txpy.gchelper.storage.concurrency import batched, bounded_map
+
+def test_batched():
+
+    assert list(batched(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(batched([], 3)) == []
+
+def test_bounded_map_keeps_the_order():
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = bounded_map(executor, lambda i: time.sleep(0.001 * (i % 3)) or i * i, range(20), 4)
+        assert list(results) == [i * i for i in range(20)]
+
+def test_bounded_map_unordered_yields_every_result():
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = bounded_map(executor, lambda i: time.sleep(0.001 * (i % 3)) or i, range(20), 4, ordered=False)
+        assert sorted(results) == list(range(20))
+
+def test_bounded_map_consumes_items_lazily():
+
+    lock = threading.Lock()
+    counts = dict(consumed=0, done=0, ahead=0)
+
+    def items():
+        for i in range(30):
+            with lock:
+                counts['consumed'] += 1
+                counts['ahead'] = max(counts['ahead'], counts['consumed'] - counts['done'])
+            yield i
+
+    def func(i):
+        time.sleep(0.002)
+        with lock:
+            counts['done'] += 1
+
+    limits = iter([2] * 10 + [5] * 100)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert len(list(bounded_map(executor, func, items(), lambda: next(limits)))) == 30
+
+    # the window, plus the item being submitted
+    assert counts['ahead'] <= 5 + 1
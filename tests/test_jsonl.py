@@ -0,0 +1,26 @@
+import io
+import json
+
+from txpy.gchelper.storage.jsonl import encode_jsonl_line, iter_lines
+
+def test_records_are_encoded_on_one_line():
+
+    line = encode_jsonl_line({'name': 'a.png', 'text': 'première\nligne'})
+    assert line.endswith(b'\n')
+    assert line.count(b'\n') == 1
+    assert json.loads(line) == {'name': 'a.png', 'text': 'première\nligne'}
+
+def test_encoded_lines_are_kept():
+
+    assert encode_jsonl_line('{"a":1}') == b'{"a":1}\n'
+    assert encode_jsonl_line(b'{"a":1}\n') == b'{"a":1}\n'
+
+def test_iter_lines_across_chunks():
+
+    reader = io.BytesIO(b'first\nsecond line\n\nlast')
+    assert list(iter_lines(reader, chunk_size=3)) == [b'first', b'second line', b'', b'last']
+
+def test_iter_lines_of_a_terminated_file():
+
+    assert list(iter_lines(io.BytesIO(b'a\nb\n'), chunk_size=1)) == [b'a', b'b']
+    assert list(iter_lines(io.BytesIO(b''))) == []
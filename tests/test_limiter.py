@@ -0,0 +1,52 @@
+import time
+
+from txpy.gchelper.automl.limiter import AimdLimiter
+
+def test_limit_grows_by_about_one_per_round():
+
+    limiter = AimdLimiter(initial=4)
+    for _ in range(4):
+        limiter.on_success(time.monotonic(), 0.1)
+    assert limiter.limit == 4
+
+    for _ in range(4):
+        limiter.on_success(time.monotonic(), 0.1)
+    assert limiter.limit == 5
+
+def test_limit_is_capped_at_maximum():
+
+    limiter = AimdLimiter(initial=4, maximum=5)
+    for _ in range(100):
+        limiter.on_success(time.monotonic(), 0.1)
+    assert limiter.limit == 5
+
+def test_throttle_decreases_once_per_round():
+
+    limiter = AimdLimiter(initial=8)
+    start_time = time.monotonic()
+
+    limiter.on_throttle(start_time)
+    assert limiter.limit == 4
+
+    # sent before the decrease: the limit already accounts for it
+    limiter.on_throttle(start_time)
+    assert limiter.limit == 4
+
+    limiter.on_throttle(time.monotonic())
+    assert limiter.limit == 2
+
+def test_limit_is_kept_at_minimum():
+
+    limiter = AimdLimiter(initial=2, minimum=1)
+    for _ in range(5):
+        limiter.on_throttle(time.monotonic())
+    assert limiter.limit == 1
+
+def test_slow_calls_count_as_throttled():
+
+    limiter = AimdLimiter(initial=8, latency_target=0.5)
+    limiter.on_success(time.monotonic(), 0.1)
+    assert limiter.limit == 8
+
+    limiter.on_success(time.monotonic(), 1.0)
+    assert limiter.limit == 4
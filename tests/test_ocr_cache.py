@@ -0,0 +1,115 @@
+import base64
+import hashlib
+
+from types import SimpleNamespace
+
+import pytest
+
+from txpy.gchelper.vision.cache import SqliteOcrCache, cache_key, open_ocr_cache
+from txpy.gchelper.vision.ocr import OcrResult, _CachedResults
+
+def image(name, content, md5=True):
+    return SimpleNamespace(
+        name=name,
+        size=len(content),
+        md5_hash=base64.b64encode(hashlib.md5(content).digest()).decode('utf-8') if md5 else None,
+        crc32c='yZRlqg==')
+
+@pytest.fixture
+def cache(tmp_path):
+
+    cache = SqliteOcrCache(str(tmp_path / 'ocr.db'))
+    yield cache
+    cache.close()
+
+#region cache_key
+
+def test_cache_key_is_the_md5():
+
+    assert cache_key(image('a.png', b'content')) == hashlib.md5(b'content').hexdigest()
+
+def test_composite_objects_are_keyed_by_crc32c_and_size():
+
+    assert cache_key(image('a.png', b'hello world', md5=False)) == 'crc32c-c99465aa-11'
+
+def test_no_key_without_hashes():
+
+    assert cache_key(SimpleNamespace(name='a.png', size=1, md5_hash=None, crc32c=None)) is None
+
+#endregion
+
+#region SqliteOcrCache
+
+def test_sqlite_cache_round_trip(tmp_path):
+
+    path = str(tmp_path / 'ocr.db')
+    cache = open_ocr_cache(path)
+    assert isinstance(cache, SqliteOcrCache)
+
+    assert cache.get('k1') is None
+    cache.put('k1', 'text')
+    cache.put('k2', None)
+    assert cache.get('k1') == 'text'
+    cache.close()
+
+    reopened = SqliteOcrCache(path)
+    assert reopened.get('k1') == 'text'
+    # an image without text is a hit, not a miss
+    assert reopened.get('k2') == ''
+    reopened.close()
+
+#endregion
+
+#region _CachedResults
+
+def test_hits_are_written_without_annotation(cache):
+
+    cache.put(cache_key(image('a.png', b'a')), 'text of a')
+    written = list()
+    cached_results = _CachedResults(cache, written.append)
+
+    blobs = list(cached_results.filter([image('a.png', b'a'), image('b.png', b'b')]))
+    assert [blob.name for blob in blobs] == ['b.png']
+    assert written == [OcrResult('a.png', 'text of a')]
+    assert cached_results.hits == 1
+
+def test_hits_go_to_write_hit_when_set(cache):
+
+    cache.put(cache_key(image('a.png', b'a')), '')
+    written, hits = list(), list()
+    cached_results = _CachedResults(cache, written.append)
+    cached_results.write_hit = hits.append
+
+    assert list(cached_results.filter([image('a.png', b'a')])) == []
+    assert written == []
+    # an empty text is a hit without text
+    assert hits == [OcrResult('a.png', None)]
+
+def test_duplicates_are_annotated_once(cache):
+
+    written = list()
+    cached_results = _CachedResults(cache, written.append)
+
+    blobs = list(cached_results.filter(
+        [image('a.png', b'same'), image('b.png', b'other'), image('c.png', b'same'), image('d.png', b'same')]))
+    assert [blob.name for blob in blobs] == ['a.png', 'b.png']
+    assert written == []
+
+    assert cached_results.write(OcrResult('a.png', 'text')) == 3
+    assert written == [OcrResult('a.png', 'text'), OcrResult('c.png', 'text'), OcrResult('d.png', 'text')]
+    assert cache.get(cache_key(image('a.png', b'same'))) == 'text'
+
+def test_failures_are_not_cached(cache):
+
+    written = list()
+    cached_results = _CachedResults(cache, written.append)
+    blobs = list(cached_results.filter([image('a.png', b'same'), image('b.png', b'same')]))
+    assert [blob.name for blob in blobs] == ['a.png']
+
+    error = ValueError('failed')
+    assert cached_results.write(OcrResult('a.png', error=error)) == 2
+    assert [result.blob_name for result in written] == ['a.png', 'b.png']
+    assert all(result.error is error for result in written)
+    assert cache.get(cache_key(image('a.png', b'same'))) is None
+
+#endregion
@@ -0,0 +1,15 @@
+import pytest
+
+from txpy.gchelper.storage.paths import split_gcs_path
+
+def test_split_gcs_path():
+
+    assert split_gcs_path('gs://bucket/a/b.jsonl') == ('bucket', 'a/b.jsonl')
+    assert split_gcs_path('gs://bucket/prefix/') == ('bucket', 'prefix/')
+    assert split_gcs_path('gs://bucket') == ('bucket', '')
+
+@pytest.mark.parametrize('path', ['bucket/name', 's3://bucket/name', 'gs:///name', '', None])
+def test_invalid_gcs_paths(path):
+
+    with pytest.raises(ValueError):
+        split_gcs_path(path)
@@ -0,0 +1,119 @@
+import threading
+import time
+
+from types import SimpleNamespace
+
+import pytest
+
+from txpy.gchelper.vision.ocr import OcrResult
+from txpy.gchelper.vision.pipeline import OcrPipeline, TokenBucket
+
+def images(count):
+    return [SimpleNamespace(name=f"image{i}.png") for i in range(count)]
+
+def annotate(batch):
+    return [OcrResult(blob.name, f"text of {blob.name}") for blob in batch]
+
+#region TokenBucket
+
+def test_token_bucket_serves_the_burst_at_once():
+
+    bucket = TokenBucket(rate_per_minute=60, burst=5)
+    assert bucket.acquire(5) == 0.0
+
+def test_token_bucket_waits_for_the_refill():
+
+    bucket = TokenBucket(rate_per_minute=600, burst=1)
+    bucket.acquire()
+
+    start_time = time.monotonic()
+    waited = bucket.acquire()
+    assert 0.05 < waited
+    assert 0.05 < time.monotonic() - start_time < 1.0
+
+def test_token_bucket_charges_requests_bigger_than_the_bucket_in_full():
+
+    # 10 tokens per second, a bucket of 2
+    bucket = TokenBucket(rate_per_minute=600, burst=2)
+    assert bucket.acquire(10) == 0.0
+
+    # the 8 tokens of debt and the 2 tokens asked are refilled first
+    start_time = time.monotonic()
+    bucket.acquire(2)
+    assert 0.9 < time.monotonic() - start_time < 1.5
+
+#endregion
+
+#region OcrPipeline
+
+def test_pipeline_annotates_and_writes_every_image():
+
+    written = list()
+    pipeline = OcrPipeline(annotate, written.append, batch_size=4, workers=3,
+        requests_per_minute=60000)
+    progress = pipeline.run(images(50))
+
+    assert sorted(result.blob_name for result in written) == sorted(blob.name for blob in images(50))
+    assert (progress.listed, progress.annotated, progress.written, progress.requests) == (50, 50, 50, 13)
+
+def test_pipeline_counts_failures():
+
+    def annotate_failing(batch):
+        return [OcrResult(blob.name, error=ValueError('no')) for blob in batch]
+
+    progress = OcrPipeline(annotate_failing, lambda result: None, batch_size=2,
+        requests_per_minute=60000).run(images(10))
+    assert (progress.annotated, progress.failed, progress.written) == (0, 10, 10)
+
+def test_slow_writer_stalls_the_listing():
+
+    lock = threading.Lock()
+    counts = dict(listed=0, written=0, ahead=0)
+
+    def listing():
+        for blob in images(60):
+            with lock:
+                counts['listed'] += 1
+            yield blob
+
+    def write(result):
+        time.sleep(0.005)
+        with lock:
+            counts['written'] += 1
+            counts['ahead'] = max(counts['ahead'], counts['listed'] - counts['written'])
+
+    OcrPipeline(annotate, write, batch_size=1, workers=2, queue_size=2,
+        requests_per_minute=600000).run(listing())
+
+    # queued batches, batches held by the workers and the lister, queued results
+    assert counts['written'] == 60
+    assert counts['ahead'] <= 2 + 2 + 1 + 2 + 2
+
+def test_results_put_by_the_listing_thread_are_written():
+
+    written = list()
+    pipeline = OcrPipeline(annotate, written.append, batch_size=2, requests_per_minute=60000)
+
+    def listing():
+        for blob in images(10):
+            if blob.name.startswith('image1'):
+                yield blob
+            else:
+                pipeline.put_result(OcrResult(blob.name, 'cached'))
+
+    progress = pipeline.run(listing())
+    assert len(written) == 10
+    assert (progress.annotated, progress.cached, progress.written) == (1, 9, 10)
+
+def test_listing_errors_are_raised_after_the_drain():
+
+    written = list()
+    def listing():
+        yield from images(3)
+        raise IOError('listing failed')
+
+    with pytest.raises(IOError):
+        OcrPipeline(annotate, written.append, batch_size=1, requests_per_minute=60000).run(listing())
+    assert len(written) == 3
+
+#endregion
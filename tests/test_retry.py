@@ -0,0 +1,101 @@
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from google.api_core import exceptions
+
+from txpy.gchelper.storage.retry import HedgePolicy, RetryPolicy
+
+def failing(failures, error=exceptions.ServiceUnavailable):
+    '''
+    Returns a function raising error on its first failures calls, then
+    returning its call count, and the list of its calls.
+    '''
+
+    calls = list()
+    def func():
+        calls.append(time.monotonic())
+        if len(calls) <= failures:
+            raise error('failed')
+        return len(calls)
+
+    return func, calls
+
+#region RetryPolicy
+
+def test_retry_policy_retries_retryable_errors():
+
+    func, calls = failing(2)
+    assert RetryPolicy(initial=0.001).call(func) == 3
+
+def test_retry_policy_raises_other_errors_at_once():
+
+    func, calls = failing(1, exceptions.NotFound)
+    with pytest.raises(exceptions.NotFound):
+        RetryPolicy(initial=0.001).call(func)
+    assert len(calls) == 1
+
+def test_retry_policy_gives_up_at_the_deadline():
+
+    func, calls = failing(10000)
+    with pytest.raises(exceptions.ServiceUnavailable):
+        RetryPolicy(initial=0.01, maximum=0.01, deadline=0.1).call(func)
+    assert 1 < len(calls)
+    # the last attempt starts before the deadline, sleeps may overshoot a little
+    assert calls[-1] - calls[0] < 0.2
+
+#endregion
+
+#region HedgePolicy
+
+def test_hedge_policy_does_not_hedge_fast_calls():
+
+    policy = HedgePolicy(initial_delay=1.0, budget=1.0)
+    for _ in range(10):
+        assert policy.call(lambda: 'ok') == 'ok'
+    assert policy.hedges == 0
+
+def test_hedge_policy_returns_the_first_answer():
+
+    lock = threading.Lock()
+    calls = list()
+    def func():
+        with lock:
+            calls.append(1)
+            first = len(calls) == 1
+        if first:
+            time.sleep(1.0)
+        return 'slow' if first else 'fast'
+
+    policy = HedgePolicy(initial_delay=0.05, budget=1.0)
+    start_time = time.monotonic()
+    assert policy.call(func) == 'fast'
+    assert time.monotonic() - start_time < 0.5
+    assert policy.hedges == 1
+
+def test_hedge_policy_stays_within_its_budget():
+
+    policy = HedgePolicy(initial_delay=0.001, min_delay=0.001, budget=0.1)
+    for _ in range(20):
+        policy.call(time.sleep, 0.01)
+    assert policy.calls == 20
+    assert policy.hedges <= 2
+
+def test_hedge_policy_does_not_count_queueing_time():
+
+    # each call takes less than the delay, but waits for the single worker
+    policy = HedgePolicy(initial_delay=0.1, max_workers=1, budget=1.0)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _: policy.call(time.sleep, 0.03), range(8)))
+    assert policy.hedges == 0
+
+def test_hedge_policy_raises_when_every_attempt_failed():
+
+    func, calls = failing(2, exceptions.NotFound)
+    with pytest.raises(exceptions.NotFound):
+        HedgePolicy(initial_delay=0.05, budget=1.0).call(func)
+
+#endregion
@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+from txpy.gchelper.storage import sync
+from txpy.gchelper.storage.sync import SyncManifest
+from txpy.gchelper.storage.transfer import compute_crc32c
+
+@pytest.fixture
+def local_file(tmp_path):
+
+    path = tmp_path / 'a.txt'
+    path.write_bytes(b'hello world')
+    return str(path)
+
+def test_unknown_files_are_hashed(tmp_path, local_file):
+
+    manifest = SyncManifest(str(tmp_path / 'manifest.json'))
+    crc32c = manifest.crc32c('a.txt', local_file, os.stat(local_file))
+
+    assert crc32c == compute_crc32c(local_file)
+    # CRC32C of b'hello world', base64-encoded like Blob.crc32c
+    assert crc32c == 'yZRlqg=='
+
+def test_unchanged_files_are_not_hashed_again(tmp_path, local_file, monkeypatch):
+
+    manifest = SyncManifest(str(tmp_path / 'manifest.json'))
+    stat = os.stat(local_file)
+    manifest.update('a.txt', stat, 'cached')
+
+    monkeypatch.setattr(sync, 'compute_crc32c', lambda file_name: pytest.fail('hashed again'))
+    assert manifest.crc32c('a.txt', local_file, stat) == 'cached'
+
+def test_modified_files_are_hashed_again(tmp_path, local_file):
+
+    manifest = SyncManifest(str(tmp_path / 'manifest.json'))
+    manifest.update('a.txt', os.stat(local_file), 'cached')
+
+    with open(local_file, 'ab') as f:
+        f.write(b'!')
+    assert manifest.crc32c('a.txt', local_file, os.stat(local_file)) == compute_crc32c(local_file)
+
+def test_manifest_round_trip(tmp_path, local_file):
+
+    path = str(tmp_path / 'manifest.json')
+    manifest = SyncManifest(path)
+    manifest.update('a.txt', os.stat(local_file), 'cached')
+    manifest.update('b.txt', os.stat(local_file), 'other')
+    manifest.remove('b.txt')
+    manifest.save()
+
+    assert SyncManifest(path).entries == {
+        'a.txt': {'size': 11, 'mtime_ns': os.stat(local_file).st_mtime_ns, 'crc32c': 'cached'}}
+
+def test_corrupt_manifest_is_ignored(tmp_path):
+
+    path = tmp_path / 'manifest.json'
+    path.write_text('{not json')
+    assert SyncManifest(str(path)).entries == {}
+
+def test_files_downloaded_from_encoded_blobs(tmp_path, local_file):
+
+    manifest = SyncManifest(str(tmp_path / 'manifest.json'))
+    manifest.update('a.txt', os.stat(local_file), None, remote_crc32c='remote')
+
+    assert manifest.downloaded_from('a.txt', os.stat(local_file), 'remote')
+    assert not manifest.downloaded_from('a.txt', os.stat(local_file), 'overwritten')
+    # the CRC32C of the encoded blob is never taken for the one of the file
+    assert manifest.crc32c('a.txt', local_file, os.stat(local_file)) == compute_crc32c(local_file)
+
+    with open(local_file, 'ab') as f:
+        f.write(b'!')
+    assert not manifest.downloaded_from('a.txt', os.stat(local_file), 'remote')
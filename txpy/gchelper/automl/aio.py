@@ -0,0 +1,154 @@
+import asyncio
+import itertools
+import logging
+
+from typing import Iterable, List, Sequence, Union
+
+from google.cloud import automl
+
+from .models import PredictionResult, example_payload
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENCY = 256
+
+class AsyncModels:
+    '''
+    asyncio counterpart of the online predictions of Models, on
+    PredictionServiceAsyncClient.
+
+    The clients, and their gRPC channels, are shared by all the requests. A
+    channel multiplexes up to about a hundred concurrent calls; give several
+    clients (see from_service_account_json) to go beyond that on one event loop.
+    '''
+
+    def __init__(self,
+        prediction_client : Union[automl.PredictionServiceAsyncClient, Sequence[automl.PredictionServiceAsyncClient]],
+        project_id : str,
+        region : str
+        ):
+        '''
+        prediction_client: one client, or several used in turn.
+        '''
+
+        if not isinstance(prediction_client, (list, tuple)):
+            prediction_client = [prediction_client]
+
+        self.prediction_clients = list(prediction_client)
+        self.project_id = project_id
+        self.region = region
+        self._clients = itertools.cycle(self.prediction_clients)
+
+    @classmethod
+    def from_service_account_json(cls,
+        service_acct : str,
+        project_id : str,
+        region : str,
+        channels : int = 1
+        ):
+
+        clients = [
+            automl.PredictionServiceAsyncClient.from_service_account_file(service_acct)
+            for _ in range(channels)]
+        return cls(clients, project_id, region)
+
+    async def close(self):
+
+        for client in self.prediction_clients:
+            await client.transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def vision_predict(self,
+        model_id : str,
+        image : bytes,
+        score_threshold : float = 0.7,
+        timeout : float = None
+        ):
+        '''
+        timeout: deadline of the request in seconds.
+        '''
+
+        response_payload = None
+        try:
+            params = {"score_threshold": str(score_threshold)} if score_threshold else {}
+            response = await self._predict(model_id, image, params, timeout)
+            response_payload = response.payload
+
+        except Exception:
+            logger.exception("")
+
+        return response_payload
+
+    async def nlp_predict(self,
+        model_id : str,
+        content : str,
+        timeout : float = None
+        ):
+        '''
+        timeout: deadline of the request in seconds.
+        '''
+
+        response_payload = None
+        try:
+            response = await self._predict(model_id, content, None, timeout)
+            response_payload = response.payload
+
+        except Exception:
+            logger.exception("")
+
+        return response_payload
+
+    async def predict_many(self,
+        model_id : str,
+        items : Iterable,
+        params : dict = None,
+        max_concurrency : int = DEFAULT_MAX_CONCURRENCY,
+        timeout : float = None
+        ) -> List[PredictionResult]:
+        """Runs the predictions of items concurrently, see Models.predict_many.
+
+        Args:
+            items: image bytes, text str or ExamplePayload.
+            max_concurrency: calls in flight.
+            timeout: deadline of each request in seconds.
+        Returns:
+            one PredictionResult per item, in order.
+        """
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def predict(index, item):
+            try:
+                response = await self._predict(model_id, item, params, timeout)
+            except Exception as e:
+                logger.exception(f"Prediction failed for item {index}")
+                return PredictionResult(index, error=e)
+            finally:
+                semaphore.release()
+
+            return PredictionResult(index, response.payload)
+
+        # items are consumed as calls complete, not all turned into tasks at once
+        tasks = list()
+        for index, item in enumerate(items):
+            await semaphore.acquire()
+            tasks.append(asyncio.ensure_future(predict(index, item)))
+
+        return list(await asyncio.gather(*tasks))
+
+    async def _predict(self,
+        model_id : str,
+        item,
+        params : dict,
+        timeout : float
+        ):
+
+        model_full_id = f"projects/{self.project_id}/locations/{self.region}/models/{model_id}"
+        request = automl.PredictRequest(name=model_full_id, payload=example_payload(item), params=params or {})
+
+        return await next(self._clients).predict(request=request, timeout=timeout)
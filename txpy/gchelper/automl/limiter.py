@@ -0,0 +1,60 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class AimdLimiter:
+    '''
+    Concurrency limit adapted like TCP congestion control: additive increase
+    of about one slot per round of successful calls, multiplicative decrease
+    on throttling or, when latency_target is set, on calls slower than it.
+    Only one decrease applies per round: calls started before the last
+    decrease do not shrink the limit again.
+    '''
+
+    def __init__(self,
+        initial : int = 4,
+        minimum : int = 1,
+        maximum : int = 64,
+        decrease : float = 0.5,
+        latency_target : float = None
+        ):
+
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self._limit = float(initial)
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def on_success(self,
+        start_time : float,
+        latency : float
+        ):
+        '''
+        start_time: time.monotonic() when the call was sent.
+        '''
+
+        if self.latency_target and latency > self.latency_target:
+            self.on_throttle(start_time)
+            return
+
+        with self._lock:
+            self._limit = min(self.maximum, self._limit + 1.0 / self._limit)
+
+    def on_throttle(self, start_time : float):
+
+        with self._lock:
+            if start_time < self._last_decrease:
+                return
+
+            self._limit = max(self.minimum, self._limit * self.decrease)
+            self._last_decrease = time.monotonic()
+
+        logger.info(f"Concurrency limit lowered to {self.limit}")
@@ -1,28 +1,75 @@
+import json
 import logging
 import io as io
+import posixpath
+import time
 
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, NamedTuple, Union
 
-from google.cloud import automl
+from google.cloud import automl, storage
 from google.cloud.automl import Model
+from google.api_core import exceptions
 from google.api_core.operation import Operation
 
+from ..storage.blobs import Blobs
+from ..storage.concurrency import bounded_map
+from ..storage.jsonl import iter_lines
+from ..storage.paths import split_gcs_path
+from ..storage.retry import RetryPolicy
+from .limiter import AimdLimiter
+
 
 logger = logging.getLogger(__name__)
 
+def example_payload(item) -> automl.ExamplePayload:
+    '''
+    Returns the payload predicting item: image bytes, text str or an ExamplePayload.
+    '''
+
+    if isinstance(item, bytes):
+        return automl.ExamplePayload(image=automl.Image(image_bytes=item))
+    if isinstance(item, str):
+        return automl.ExamplePayload(text_snippet=automl.TextSnippet(content=item, mime_type="text/plain"))
+
+    return item
+
+
+class PredictionResult(NamedTuple):
+    '''
+    Outcome of the prediction of the item at index of predict_many.
+    '''
+    index : int
+    payload : list = None
+    error : Exception = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
 class Models:
 
     def __init__(self, 
         automl_client : automl.AutoMlClient,
         prediction_client : automl.PredictionServiceClient,
         project_id : str,
-        region : str
+        region : str,
+        storage_client : storage.Client = None
         ):
+        '''
+        storage_client: needed to read batch prediction results.
+        '''
 
         self.automl_client = automl_client
         self.prediction_client = prediction_client
         self.project_id = project_id
         self.region = region
+
+        self.blobsHelper = Blobs(storage_client) if storage_client else None
+
+        # throttled (429) and unavailable predictions are retried with backoff
+        self.retry_policy = RetryPolicy()
  
     def create_model(self,
         model : (Model, 'The model to create')
@@ -155,3 +202,164 @@ class Models:
             logger.exception("")
 
         return response_payload
+
+    def batch_predict(self,
+        model_id : str,
+        gcs_input : Union[str, List[str]],
+        gcs_output : str,
+        params : dict = None
+        ) -> Operation:
+        """Starts an offline batch prediction, which needs no deployed model.
+
+        Args:
+            gcs_input: gs:// URI(s) of the CSV or JSONL files listing the items.
+            gcs_output: gs:// prefix under which AutoML creates the output directory.
+            params: model specific, e.g. {"score_threshold": "0.8"}.
+        Returns:
+            the long-running operation, see wait_batch_predict and iter_batch_predictions.
+        """
+
+        response = None
+        try:
+            model_full_id = self.automl_client.model_path(self.project_id, self.region, model_id)
+
+            if isinstance(gcs_input, str):
+                gcs_input = [gcs_input]
+
+            request = automl.BatchPredictRequest(
+                name=model_full_id,
+                input_config=automl.BatchPredictInputConfig(
+                    gcs_source=automl.GcsSource(input_uris=gcs_input)),
+                output_config=automl.BatchPredictOutputConfig(
+                    gcs_destination=automl.GcsDestination(output_uri_prefix=gcs_output)),
+                params=params or {})
+            response = self.prediction_client.batch_predict(request=request)
+
+            logger.info(f"Batch prediction operation name:{response.operation.name}")
+
+        except Exception:
+            logger.exception("")
+
+        return response
+
+    def wait_batch_predict(self,
+        operation : Operation,
+        timeout : float = None
+        ) -> str:
+        '''
+        Waits for a batch prediction; returns its gs:// output directory, None on failure.
+        '''
+
+        output_directory = None
+        try:
+            operation.result(timeout=timeout)
+            output_directory = operation.metadata.batch_predict_details.output_info.gcs_output_directory
+
+            logger.info(f"Batch prediction written to {output_directory}")
+
+        except Exception:
+            logger.exception("")
+
+        return output_directory
+
+    def iter_batch_predictions(self,
+        output_directory : str,
+        errors : bool = False
+        ) -> Iterator[dict]:
+        """Streams the results of a batch prediction, one JSONL file at a time.
+
+        Each file is read with range requests through Blobs.open_reader, so memory
+        stays bounded whatever the number of items. Requires a storage_client.
+
+        Args:
+            output_directory: gs:// directory of the results, see wait_batch_predict.
+            errors: read the errors_N.jsonl files, listing the failed items, instead.
+        Returns:
+            a generator of the decoded records, one per item.
+        """
+
+        if self.blobsHelper is None:
+            raise ValueError("Reading batch predictions requires a storage_client")
+
+        bucket_name, prefix = split_gcs_path(output_directory.rstrip('/') + '/')
+
+        for blob in self.blobsHelper.iter_blobs(bucket_name, prefix=prefix, fields=('name',)):
+            file_name = posixpath.basename(blob.name)
+            if not file_name.endswith('.jsonl') or file_name.startswith('errors_') != errors:
+                continue
+
+            reader = self.blobsHelper.open_reader(bucket_name, blob.name, reload=False)
+            if reader is None:
+                raise IOError(f"Could not read gs://{bucket_name}/{blob.name}")
+
+            with reader:
+                for line in iter_lines(reader):
+                    if line.strip():
+                        yield json.loads(line)
+
+    def predict_many(self,
+        model_id : str,
+        items : Iterable,
+        params : dict = None,
+        max_workers : int = 16,
+        ordered : bool = True,
+        limiter : AimdLimiter = None
+        ) -> Iterator[PredictionResult]:
+        """Runs online predictions concurrently against a deployed model.
+
+        Throttled and unavailable calls are retried with the retry policy.
+
+        Args:
+            items: image bytes, text str or ExamplePayload, consumed lazily.
+            params: model specific, e.g. {"score_threshold": "0.8"}.
+            max_workers: calls in flight, the upper bound when a limiter is given.
+            ordered: yield in the order of items, otherwise as the calls complete.
+            limiter: adapts the calls in flight to the throttling (and latency)
+                observed, see AimdLimiter.
+        Returns:
+            a generator of PredictionResult.
+        """
+
+        model_full_id = self.automl_client.model_path(self.project_id, self.region, model_id)
+
+        def in_flight_limit():
+            return min(max_workers, limiter.limit) if limiter else max_workers
+
+        def predict(indexed_item):
+            index, item = indexed_item
+            return self._predict(model_full_id, index, item, params, limiter)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            yield from bounded_map(executor, predict, enumerate(items), in_flight_limit, ordered=ordered)
+
+    def _predict(self,
+        model_full_id : str,
+        index : int,
+        item,
+        params : dict,
+        limiter : AimdLimiter
+        ) -> PredictionResult:
+
+        request = automl.PredictRequest(name=model_full_id, payload=example_payload(item), params=params or {})
+
+        def predict():
+            start_time = time.monotonic()
+            try:
+                response = self.prediction_client.predict(request=request)
+            except (exceptions.TooManyRequests, exceptions.ResourceExhausted):
+                if limiter:
+                    limiter.on_throttle(start_time)
+                raise
+
+            if limiter:
+                limiter.on_success(start_time, time.monotonic() - start_time)
+            return response
+
+        try:
+            response = self.retry_policy.call(predict)
+
+        except Exception as e:
+            logger.exception(f"Prediction failed for item {index}")
+            return PredictionResult(index, error=e)
+
+        return PredictionResult(index, response.payload)
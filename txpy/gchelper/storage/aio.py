@@ -0,0 +1,348 @@
+import asyncio
+import logging
+
+from typing import AsyncIterator, List, Sequence
+from urllib.parse import quote
+
+import aiohttp
+import google.auth
+
+from google.auth.credentials import Credentials
+from google.auth.transport.requests import Request
+from google.oauth2 import service_account
+from google.api_core import exceptions
+
+from .blobs import LIST_FIELDS, BlobPage
+from .paths import split_gcs_path
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ('https://www.googleapis.com/auth/devstorage.full_control',)
+
+API_URL = 'https://storage.googleapis.com/storage/v1'
+UPLOAD_URL = 'https://storage.googleapis.com/upload/storage/v1'
+
+DEFAULT_MAX_CONNECTIONS = 256
+
+class AsyncStorageSession:
+    '''
+    Pooled aiohttp session calling the Cloud Storage JSON API with OAuth2 credentials.
+
+    All the requests of a process share max_connections keep-alive connections,
+    so thousands of small operations can be in flight on one event loop.
+    Errors are raised as google.api_core.exceptions, like the synchronous client.
+    '''
+
+    def __init__(self,
+        credentials : Credentials = None,
+        max_connections : int = DEFAULT_MAX_CONNECTIONS,
+        timeout : float = 60
+        ):
+
+        if credentials is None:
+            credentials, _ = google.auth.default(scopes=SCOPES)
+
+        self.credentials = credentials
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._session = None
+        self._token_lock = None
+
+    @classmethod
+    def from_service_account_json(cls, service_acct : str, **kwargs):
+
+        credentials = service_account.Credentials.from_service_account_file(service_acct, scopes=SCOPES)
+        return cls(credentials, **kwargs)
+
+    async def close(self):
+
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def request(self,
+        method : str,
+        url : str,
+        params : dict = None,
+        data = None,
+        headers : dict = None,
+        raw : bool = False
+        ):
+        '''
+        Sends one request; returns the decoded JSON body, or the bytes when raw is set.
+        '''
+
+        if self._session is None:
+            # created lazily to bind to the running loop
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+        request_headers = await self._auth_headers()
+        if headers:
+            request_headers.update(headers)
+
+        async with self._session.request(method, url,
+                params=params, data=data, headers=request_headers) as response:
+            if response.status >= 400:
+                raise exceptions.from_http_status(response.status, await response.text())
+            if raw:
+                return await response.read()
+            if response.status == 204:
+                return None
+            return await response.json(content_type=None)
+
+    async def _auth_headers(self) -> dict:
+
+        if not self.credentials.valid:
+            if self._token_lock is None:
+                self._token_lock = asyncio.Lock()
+            async with self._token_lock:
+                if not self.credentials.valid:
+                    # google-auth refreshes synchronously, keep it off the loop
+                    loop = asyncio.get_running_loop()
+                    await loop.run_in_executor(None, self.credentials.refresh, Request())
+
+        return {'Authorization': f"Bearer {self.credentials.token}"}
+
+
+class AsyncBlobs:
+    '''
+    asyncio counterpart of Blobs. Blob metadata is returned as JSON API
+    resources (dicts with 'name', 'size', 'generation', ...).
+    '''
+
+    def __init__(self,
+        session : AsyncStorageSession,
+        no_logging : bool = False
+        ):
+
+        self.session = session
+        self.no_logging = no_logging
+
+    async def list_blobs(self,
+        bucket_name : str,
+        prefix : str = '',
+        delimiter : str = None,
+        fields : Sequence[str] = LIST_FIELDS
+        ) -> List[dict]:
+
+        blobs = list()
+        try:
+            async for page in self.iter_blob_pages(bucket_name, prefix, delimiter, fields):
+                blobs.extend(page.blobs)
+
+        except Exception:
+            logger.exception("")
+
+        return blobs
+
+    async def iter_blob_pages(self,
+        bucket_name : str,
+        prefix : str = '',
+        delimiter : str = None,
+        fields : Sequence[str] = LIST_FIELDS,
+        page_size : int = 1000
+        ) -> AsyncIterator[BlobPage]:
+        '''
+        Lazy listing, see Blobs.iter_blob_pages. Errors are logged and re-raised.
+        '''
+
+        params = {'prefix': prefix, 'maxResults': page_size}
+        if delimiter:
+            params['delimiter'] = delimiter
+        if fields is not None:
+            params['fields'] = f"items({','.join(fields)}),prefixes,nextPageToken"
+
+        try:
+            while True:
+                response = await self.session.request('GET', f"{API_URL}/b/{quote(bucket_name, safe='')}/o",
+                    params=params)
+                yield BlobPage(response.get('items', []), sorted(response.get('prefixes', [])))
+
+                if 'nextPageToken' not in response:
+                    break
+                params['pageToken'] = response['nextPageToken']
+
+        except Exception:
+            logger.exception("")
+            raise
+
+    async def download_as_bytes(self,
+        bucket_name : str,
+        blob_name : str,
+        generation : int = None
+        ) -> bytes:
+
+        byte_stream = None
+        try:
+            params = {'alt': 'media'}
+            if generation:
+                params['generation'] = generation
+
+            byte_stream = await self.session.request('GET', self._object_url(bucket_name, blob_name),
+                params=params, raw=True)
+
+        except Exception:
+            logger.exception("")
+
+        return byte_stream
+
+    async def download_to_filename(self,
+        bucket_name : str,
+        blob_name : str,
+        file_name : str
+        ) -> bool:
+
+        data = await self.download_as_bytes(bucket_name, blob_name)
+        if data is None:
+            return False
+
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._write_file, file_name, data)
+            return True
+
+        except Exception:
+            logger.exception("")
+
+        return False
+
+    async def upload_file_as_bytes(self,
+        bucket_name : str,
+        prefix : str,
+        data : bytes,
+        content_type : str = ''
+        ) -> dict:
+        '''
+        Single-request media upload; returns the created blob resource.
+        '''
+
+        resource = None
+        try:
+            resource = await self.session.request('POST',
+                f"{UPLOAD_URL}/b/{quote(bucket_name, safe='')}/o",
+                params={'uploadType': 'media', 'name': prefix},
+                data=data,
+                headers={'Content-Type': content_type or 'application/octet-stream'})
+
+            if self.no_logging == False:
+                logger.info(f"File uploaded to {prefix}")
+
+        except Exception:
+            logger.exception("")
+
+        return resource
+
+    async def upload_file(self,
+        bucket_name : str,
+        source_file_name : str,
+        prefix : str,
+        content_type : str = ''
+        ) -> dict:
+
+        try:
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(None, self._read_file, source_file_name)
+
+        except Exception:
+            logger.exception("")
+            return None
+
+        return await self.upload_file_as_bytes(bucket_name, prefix, data, content_type)
+
+    async def save_jsonl_content(self,
+        json_content : str,
+        full_gcs_path : str
+        ) -> dict:
+
+        try:
+            bucket_name, blob_name = split_gcs_path(full_gcs_path)
+
+        except Exception:
+            logger.exception("")
+            return None
+
+        return await self.upload_file_as_bytes(bucket_name, blob_name,
+            json_content.encode('utf-8'), content_type='application/jsonl')
+
+    async def delete(self,
+        bucket_name : str,
+        blob_name : str,
+        if_generation_match : int = None
+        ) -> bool:
+
+        try:
+            params = {}
+            if if_generation_match is not None:
+                params['ifGenerationMatch'] = if_generation_match
+
+            await self.session.request('DELETE', self._object_url(bucket_name, blob_name), params=params)
+            return True
+
+        except Exception:
+            logger.exception("")
+
+        return False
+
+    def _object_url(self, bucket_name : str, blob_name : str) -> str:
+        return f"{API_URL}/b/{quote(bucket_name, safe='')}/o/{quote(blob_name, safe='')}"
+
+    @staticmethod
+    def _read_file(file_name : str) -> bytes:
+        with open(file_name, 'rb') as f:
+            return f.read()
+
+    @staticmethod
+    def _write_file(file_name : str, data : bytes):
+        with open(file_name, 'wb') as f:
+            f.write(data)
+
+
+class AsyncBuckets:
+    '''
+    asyncio counterpart of the read paths of Buckets, returning JSON API bucket resources.
+    '''
+
+    def __init__(self,
+        session : AsyncStorageSession,
+        project_id : str
+        ):
+
+        self.session = session
+        self.project_id = project_id
+
+    async def get_bucket(self, bucket_name : str) -> dict:
+
+        bucket = None
+        try:
+            bucket = await self.session.request('GET', f"{API_URL}/b/{quote(bucket_name, safe='')}")
+
+        except Exception:
+            logger.exception("")
+
+        return bucket
+
+    async def list_buckets(self) -> List[dict]:
+
+        buckets = list()
+        try:
+            params = {'project': self.project_id}
+            while True:
+                response = await self.session.request('GET', f"{API_URL}/b", params=params)
+                buckets.extend(response.get('items', []))
+
+                if 'nextPageToken' not in response:
+                    break
+                params['pageToken'] = response['nextPageToken']
+
+        except Exception:
+            logger.exception("")
+
+        return buckets
@@ -1,26 +1,94 @@
 __version__ = "0.1.0"
 
 import logging
-import subprocess
 import io
-import re
+import os
+import fnmatch
+import glob
+import mmap
+import posixpath
+import uuid
 
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Iterable, Iterator, List, NamedTuple, Sequence, Tuple, Union
 
 from google.cloud import storage
 from google.cloud.storage.blob import Blob
+from google.cloud.storage.bucket import Bucket
+from google.api_core.exceptions import NotFound
+
+from .buckets import BucketCache
+from .cache import DiskCache
+from .concurrency import batched, bounded_map
+from .codecs import ZSTD, get_codec, set_codec, compress, decompress, \
+    compressing_writer, decompressing_reader
+from .jsonl import encode_jsonl_line
+from .paths import split_gcs_path
+from .retry import RetryPolicy, HedgePolicy
+from .sync import SyncManifest, SyncResult, MANIFEST_NAME
+from .transfer import TransferManager, TransferResult, CopyResult, \
+    DEFAULT_MAX_WORKERS, DEFAULT_SLICED_THRESHOLD, DEFAULT_SLICE_SIZE, \
+    DEFAULT_COMPOSITE_THRESHOLD, DEFAULT_COMPOSITE_PART_SIZE, PART_SUFFIX
 
 logger = logging.getLogger(__name__)
 
+# Blob properties requested by the lazy listings unless told otherwise.
+LIST_FIELDS = ('name', 'size', 'generation', 'crc32c')
+
+# Range request size of the streaming reader.
+DEFAULT_READ_AHEAD = 8 * 1024 * 1024
+
+# Resumable upload chunk of the streaming writer, a multiple of 256 KB.
+DEFAULT_WRITE_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Cloud Storage accepts at most 100 calls per batch request.
+MAX_BATCH_SIZE = 100
+
+class BlobPage(NamedTuple):
+    '''
+    One page of a lazy listing.
+    '''
+    blobs : List[Blob]
+    prefixes : List[str]
+
+class DeleteResult(NamedTuple):
+    '''
+    Outcome of a single delete. error is None when the blob is gone.
+    '''
+    blob_name : str
+    generation : int = None
+    error : Exception = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
 class Blobs:
 
     def __init__(self, 
         client : storage.Client,
-        no_logging : bool = False
+        no_logging : bool = False,
+        bucket_cache : BucketCache = None,
+        disk_cache : DiskCache = None,
+        retry_policy : RetryPolicy = None,
+        hedge_policy : HedgePolicy = None
         ):
+        '''
+        disk_cache: when set, download_as_bytes and download_as_file are served 
+            from this local cache after checking the blob generation.
+        retry_policy: backoff applied to the reads of transient errors, a default
+            RetryPolicy when not set.
+        hedge_policy: when set, metadata reads, download_as_bytes and download_as_file
+            are hedged.
+        '''
 
         self.client = client
         self.no_logging = no_logging
+        self.bucket_cache = bucket_cache or BucketCache(client)
+        self.disk_cache = disk_cache
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.hedge_policy = hedge_policy
 
     
     def list_blobs(self,
@@ -36,7 +104,8 @@ class Blobs:
 
         blobs = list()
         try:
-            blobs = list(self.client.list_blobs(bucket_name, prefix=prefix, delimiter=delimiter))
+            iterator = self.client.list_blobs(bucket_name, prefix=prefix, delimiter=delimiter)
+            blobs = list(iterator)
 
             if self.no_logging == False:
                 logger.info("Blobs:")   
@@ -45,7 +114,7 @@ class Blobs:
 
                 if delimiter:
                     logger.info("Prefixes:")
-                    for prefix in blobs.prefixes:
+                    for prefix in sorted(iterator.prefixes):
                         logger.info(prefix)
         
         except Exception: 
@@ -53,33 +122,160 @@ class Blobs:
 
         return blobs
 
+    def iter_blob_pages(self,
+        bucket_name : str,
+        prefix : str = '',
+        delimiter : str = None,
+        fields : Sequence[str] = LIST_FIELDS,
+        page_size : int = 1000
+        ) -> Iterator[BlobPage]:
+        """Lists blobs lazily, one page (one HTTP request) at a time.
+
+        Args:
+            fields: blob properties requested from the server, None for the full metadata.
+            page_size: maximum number of blobs per page.
+        Returns:
+            a generator of BlobPage; the delimiter prefixes of a page are in BlobPage.prefixes.
+            Listing errors are logged and re-raised so that a listing is never silently truncated.
+        """
+
+        try:
+            iterator = self.client.list_blobs(bucket_name, 
+                prefix=prefix, 
+                delimiter=delimiter,
+                page_size=page_size,
+                fields=self._list_fields(fields))
+
+            for page in iterator.pages:
+                blob_page = BlobPage(list(page), sorted(page.prefixes))
+                logger.debug(f"Listed {len(blob_page.blobs)} blobs and "
+                    f"{len(blob_page.prefixes)} prefixes from gs://{bucket_name}/{prefix}")
+                yield blob_page
+
+        except Exception: 
+            logger.exception("")
+            raise
+
+    def iter_blobs(self,
+        bucket_name : str,
+        prefix : str = '',
+        delimiter : str = None,
+        fields : Sequence[str] = LIST_FIELDS,
+        page_size : int = 1000
+        ) -> Iterator[Blob]:
+        '''
+        Lazy counterpart of list_blobs, see iter_blob_pages.
+        '''
+
+        for page in self.iter_blob_pages(bucket_name, prefix, delimiter, fields, page_size):
+            yield from page.blobs
+
+    def _list_fields(self,
+        fields : Sequence[str]
+        ) -> str:
+
+        if fields is None:
+            return None
+
+        # nextPageToken must stay in the projection or pagination stops after one page
+        return f"items({','.join(fields)}),prefixes,nextPageToken"
+
+    def _get_blob(self,
+        bucket_name : str,
+        blob_name : str,
+        reload : bool = True
+        ) -> Blob:
+        '''
+        Returns the blob with its metadata (one GET) when reload is set, 
+        otherwise a bare handle costing no request.
+        '''
+
+        bucket = self.retry_policy.call(self.bucket_cache.get, bucket_name)
+        if reload:
+            return self._read(bucket.get_blob, blob_name)
+
+        return bucket.blob(blob_name)
+
+    def _read(self, func, *args, **kwargs):
+        '''
+        Runs an idempotent read under the retry policy, hedged when a hedge policy is set.
+        '''
+
+        if self.hedge_policy:
+            return self.retry_policy.call(self.hedge_policy.call, func, *args, **kwargs)
+
+        return self.retry_policy.call(func, *args, **kwargs)
+
     #region Download
 
     def download_files(self,
         bucket_name : str,
         prefix : str = '/',
         destination_folder : str = '.',           
-        extension_filter : str = "*"      
-        ):
+        extension_filter : str = "*",
+        max_workers : int = DEFAULT_MAX_WORKERS,
+        sliced_threshold : int = DEFAULT_SLICED_THRESHOLD,
+        slice_size : int = DEFAULT_SLICE_SIZE
+        ) -> List[TransferResult]:
+        """Downloads the blobs directly under prefix matching *.extension_filter.
 
-        try:            
-            subprocess.run(
-                f"gsutil -m cp gs://{bucket_name}/{prefix}*.{extension_filter} {destination_folder}",
-                shell=True)
+        Args:
+            max_workers: number of files (and of slices) downloaded concurrently.
+            sliced_threshold: blobs bigger than this are downloaded as parallel byte ranges.
+            slice_size: size of a byte range of a sliced download.
+        Returns:
+            one TransferResult per matching blob.
+        """
+
+        results = list()
+        try:
+            pattern = f"*.{extension_filter}"
+            jobs = [
+                (blob, os.path.join(destination_folder, blob.name[len(prefix):]))
+                for blob in self.iter_blobs(bucket_name, prefix=prefix, fields=LIST_FIELDS + ('contentEncoding',))
+                if '/' not in blob.name[len(prefix):]
+                    and fnmatch.fnmatchcase(blob.name[len(prefix):], pattern)]
+
+            transfer_manager = TransferManager(self.client,
+                retry_policy=self.retry_policy,
+                max_workers=max_workers,
+                sliced_threshold=sliced_threshold,
+                slice_size=slice_size)
+            results = transfer_manager.download_many(jobs)
+
+            if self.no_logging == False:
+                failed = [result for result in results if not result.succeeded]
+                logger.info(f"Downloaded {len(results) - len(failed)}/{len(results)} files "
+                    f"from gs://{bucket_name}/{prefix} to {destination_folder}")
+                for result in failed:
+                    logger.error(f"Failed to download {result.blob_name}: {result.error}")
 
         except Exception: 
             logger.exception("")
 
+        return results
+
     def download_as_bytes(self,
         bucket_name : str,
-        blob_name : str
+        blob_name : str,
+        reload : bool = True
         ) -> bytes:
+        '''
+        reload: False skips the metadata GET made before the download. Blobs 
+            compressed with zstd are then returned compressed.
+        '''
 
         byte_stream = None
         try:            
-            bucket = self.client.get_bucket(bucket_name)
-            blob = bucket.get_blob(blob_name)
-            byte_stream = blob.download_as_bytes()
+            if self.disk_cache:
+                with self._open_cached(bucket_name, blob_name) as f:
+                    return f.read()
+
+            blob = self._get_blob(bucket_name, blob_name, reload)
+            # gzip is decoded by the client library itself
+            byte_stream = self._read(blob.download_as_bytes)
+            if reload and get_codec(blob) == ZSTD:
+                byte_stream = decompress(byte_stream, ZSTD)
 
         except Exception: 
             logger.exception("")
@@ -88,21 +284,176 @@ class Blobs:
     
     def download_as_file(self,
         bucket_name : str,
-        blob_name : str
+        blob_name : str,
+        reload : bool = True
         ) -> io.BytesIO:
+        '''
+        reload: False skips the metadata GET made before the download.
+
+        The whole blob is loaded in memory, see open_reader for large blobs.
+        '''
 
         byte_stream = io.BytesIO()
         try:            
-            bucket = self.client.get_bucket(bucket_name)
-            blob = bucket.get_blob(blob_name)
-            blob.download_to_file(byte_stream)
-            byte_stream.seek(0)
+            if self.disk_cache:
+                with self._open_cached(bucket_name, blob_name) as f:
+                    return io.BytesIO(f.read())
+
+            blob = self._get_blob(bucket_name, blob_name, reload)
+            # a hedged read needs a buffer per attempt
+            data = self._read(blob.download_as_bytes)
+            if reload and get_codec(blob) == ZSTD:
+                data = decompress(data, ZSTD)
+            byte_stream = io.BytesIO(data)
 
         except Exception: 
             logger.exception("")
 
         return byte_stream
 
+    def download_into(self,
+        bucket_name : str,
+        blob_name : str,
+        buffer,
+        max_workers : int = DEFAULT_MAX_WORKERS,
+        slice_size : int = DEFAULT_SLICE_SIZE
+        ) -> int:
+        """Downloads a blob into a caller-provided writable buffer.
+
+        Args:
+            buffer: bytearray, memoryview, mmap or numpy array of at least the blob size.
+                Slices of slice_size are filled in place by up to max_workers range requests.
+        Returns:
+            the number of bytes written, None on failure.
+        """
+
+        written = None
+        try:
+            blob = self._get_blob(bucket_name, blob_name, reload=True)
+
+            transfer_manager = TransferManager(self.client,
+                retry_policy=self.retry_policy,
+                max_workers=max_workers, 
+                slice_size=slice_size)
+            written = transfer_manager.download_to_buffer(blob, buffer)
+
+        except Exception: 
+            logger.exception("")
+
+        return written
+
+    def download_to_mmap(self,
+        bucket_name : str,
+        blob_name : str,
+        file_name : str,
+        max_workers : int = DEFAULT_MAX_WORKERS,
+        slice_size : int = DEFAULT_SLICE_SIZE
+        ) -> mmap.mmap:
+        '''
+        Downloads a blob into a local file pre-sized to the blob and returns it memory-mapped,
+        e.g. for numpy.frombuffer. The caller closes the map. Returns None on failure,
+        the file being removed, and for an empty blob, which cannot be mapped.
+        '''
+
+        mapped = None
+        created = False
+        try:
+            blob = self._get_blob(bucket_name, blob_name, reload=True)
+            if not blob.size:
+                raise ValueError(f"{blob_name} is empty, an empty file cannot be memory-mapped")
+
+            with open(file_name, 'w+b') as f:
+                created = True
+                f.truncate(blob.size)
+                mapped = mmap.mmap(f.fileno(), blob.size)
+
+            transfer_manager = TransferManager(self.client,
+                retry_policy=self.retry_policy,
+                max_workers=max_workers, 
+                slice_size=slice_size)
+            transfer_manager.download_to_buffer(blob, mapped)
+            mapped.flush()
+
+        except Exception: 
+            logger.exception("")
+            if mapped is not None:
+                try:
+                    mapped.close()
+                except BufferError:
+                    # views held by the failed download's traceback, unmapped once collected
+                    pass
+                mapped = None
+            if created and os.path.exists(file_name):
+                os.remove(file_name)
+
+        return mapped
+
+    def open_reader(self,
+        bucket_name : str,
+        blob_name : str,
+        read_ahead : int = DEFAULT_READ_AHEAD,
+        reload : bool = True
+        ) -> IO[bytes]:
+        """Opens a seekable, read-only file object over the blob.
+
+        Content is fetched with range requests of read_ahead bytes as it is read,
+        so memory stays bounded whatever the blob size. Compressed blobs (see 
+        codecs) are decompressed incrementally; that reader only seeks forward.
+
+        Args:
+            reload: fetch the metadata first, pinning reads to the current generation.
+        """
+
+        reader = None
+        try:
+            blob = self._get_blob(bucket_name, blob_name, reload)
+
+            codec = get_codec(blob) if reload else None
+            if codec:
+                # range requests over the stored bytes, decoded here
+                reader = decompressing_reader(
+                    blob.open('rb', chunk_size=read_ahead, raw_download=True), codec)
+            else:
+                reader = blob.open('rb', chunk_size=read_ahead)
+
+        except Exception: 
+            logger.exception("")
+
+        return reader
+
+    def _open_cached(self,
+        bucket_name : str,
+        blob_name : str
+        ) -> IO[bytes]:
+        '''
+        Opens the disk cache entry of the live generation of the blob, 
+        downloading it on a miss. Costs one metadata GET on a hit.
+        '''
+
+        blob = self._get_blob(bucket_name, blob_name, reload=True)
+
+        f = self.disk_cache.open(bucket_name, blob_name, blob.generation)
+        if f is None:
+            def download(f):
+                # every attempt starts over
+                f.seek(0)
+                f.truncate()
+                blob.download_to_file(f)
+
+            path = self.disk_cache.put(bucket_name, blob_name, blob.generation, 
+                lambda f: self.retry_policy.call(download, f))
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                # evicted right away, e.g. by another process or a blob bigger than the cache
+                f = io.BytesIO(self._read(blob.download_as_bytes))
+
+        # the cache holds what the client library returns: gzip decoded, zstd not
+        if get_codec(blob) == ZSTD:
+            f = decompressing_reader(f, ZSTD)
+
+        return f
+
     #endregion 
 
     #region Upload
@@ -110,33 +461,55 @@ class Blobs:
     def upload_file(self, 
             bucket_name : str, 
             source_file_name : str, 
-            prefix : str = '/'):
+            prefix : str = '/',
+            composite_threshold : int = DEFAULT_COMPOSITE_THRESHOLD,
+            composite_part_size : int = DEFAULT_COMPOSITE_PART_SIZE,
+            max_workers : int = DEFAULT_MAX_WORKERS
+            ) -> TransferResult:
+        '''
+        Files bigger than composite_threshold are sent as a parallel composite upload
+        of max_workers concurrent parts composed server-side.
+        '''
        
+        result = None
         try:
             bucket = self.client.bucket(bucket_name)
             blob = bucket.blob(prefix)
 
-            blob.upload_from_filename(source_file_name)
+            transfer_manager = TransferManager(self.client,
+                max_workers=max_workers,
+                composite_threshold=composite_threshold,
+                composite_part_size=composite_part_size)
+            result = transfer_manager.upload_blob(source_file_name, blob)
 
-            logger.info(f"File {source_file_name} uploaded to {prefix}.")
+            if result.succeeded:
+                logger.info(f"File {source_file_name} uploaded to {prefix}.")
         
         except Exception: 
             logger.exception("")
 
+        return result
+
     def upload_file_as_bytes(self, 
             bucket_name : str,
             prefix : str,
             data : bytes, 
             content_type : str = '',            
+            codec : str = None
             ):
         
         '''
         content_type: application/pdf, image/jpeg, application/octet-stream
+        codec: 'gzip' or 'zstd' to store the data compressed, see codecs
         ''' 
         try:
             bucket = self.client.bucket(bucket_name)            
             blob = bucket.blob(prefix)
 
+            if codec:
+                set_codec(blob, codec)
+                data = compress(data, codec)
+
             if content_type:
                 blob.upload_from_string(data, content_type=content_type)
             else:
@@ -151,57 +524,593 @@ class Blobs:
         bucket_name : str,
         prefix : str = '',
         source_folder : str = '.',
-        extension_filter : str = "*",            
-        ):
+        extension_filter : str = "*",
+        pattern : str = None,
+        max_workers : int = DEFAULT_MAX_WORKERS,
+        composite_threshold : int = DEFAULT_COMPOSITE_THRESHOLD,
+        composite_part_size : int = DEFAULT_COMPOSITE_PART_SIZE
+        ) -> List[TransferResult]:
+        """Uploads the files of source_folder matching *.extension_filter to prefix.
+
+        Args:
+            pattern: glob relative to source_folder used instead of extension_filter,
+                e.g. '**/*.jsonl'. Matched sub-folders are kept in the blob names.
+            max_workers: number of files (and of composite parts) uploaded concurrently.
+            composite_threshold: files bigger than this are sent as parallel composite uploads.
+        Returns:
+            one TransferResult per matching file.
+        """
+
+        results = list()
+        try:
+            pattern = pattern or f"*.{extension_filter}"
+            bucket = self.client.bucket(bucket_name)
+            jobs = [
+                (file_name, bucket.blob(
+                    prefix + os.path.relpath(file_name, source_folder).replace(os.sep, '/')))
+                for file_name in sorted(glob.glob(os.path.join(source_folder, pattern), recursive=True))
+                if os.path.isfile(file_name)]
 
-        try:           
-            subprocess.run(
-                f"gsutil -m cp {source_folder}/*.{extension_filter} gs://{bucket_name}/{prefix}",
-                shell=True)
+            transfer_manager = TransferManager(self.client,
+                max_workers=max_workers,
+                composite_threshold=composite_threshold,
+                composite_part_size=composite_part_size)
+            results = transfer_manager.upload_many(jobs)
+
+            if self.no_logging == False:
+                failed = [result for result in results if not result.succeeded]
+                logger.info(f"Uploaded {len(results) - len(failed)}/{len(results)} files "
+                    f"from {source_folder} to gs://{bucket_name}/{prefix}")
+                for result in failed:
+                    logger.error(f"Failed to upload {result.file_name}: {result.error}")
 
         except Exception: 
             logger.exception("")
 
+        return results
+
     
+    def open_writer(self,
+        bucket_name : str,
+        blob_name : str,
+        chunk_size : int = DEFAULT_WRITE_CHUNK_SIZE,
+        content_type : str = None,
+        codec : str = None
+        ) -> IO[bytes]:
+        """Opens a write-only file object backed by a resumable upload.
+
+        Written data is sent in chunks of chunk_size (a multiple of 256 KB); 
+        the blob is finalized when the writer is closed.
+
+        Args:
+            codec: 'gzip' or 'zstd' to compress the data as it is written.
+        """
+
+        writer = None
+        try:
+            bucket = self.bucket_cache.get(bucket_name)
+            blob = bucket.blob(blob_name)
+
+            if codec:
+                set_codec(blob, codec)
+
+            writer = blob.open('wb', chunk_size=chunk_size, content_type=content_type)
+
+            if codec:
+                writer = compressing_writer(writer, codec)
+
+        except Exception: 
+            logger.exception("")
+
+        return writer
+
     def save_jsonl_content(self,
-        json_content : str,
-        full_gcs_path : str
+        json_content : Union[str, Iterable],
+        full_gcs_path : str,
+        codec : str = None
         ):
         """Saves jsonl content to specified GCS location.
 
         Args:
-            jsonl: jsonl file
+            jsonl: jsonl file (str or bytes), or an iterable of records streamed with write_jsonl
             full_gcs_path: GCS location to upload the jsonl file
+            codec: 'gzip' or 'zstd' to store the file compressed
         """
+        if not isinstance(json_content, (str, bytes)):
+            self.write_jsonl(json_content, full_gcs_path, codec=codec)
+            return
+
         try: 
-            match = re.match(r"gs://([^/]+)/(.*)", full_gcs_path)
-            bucket_name = match.group(1)
-            blob_name = match.group(2)
+            bucket_name, blob_name = split_gcs_path(full_gcs_path)
 
-            bucket = self.client.get_bucket(bucket_name)
+            bucket = self.bucket_cache.get(bucket_name)
             blob = bucket.blob(blob_name)
 
+            if codec:
+                set_codec(blob, codec)
+                if isinstance(json_content, str):
+                    json_content = json_content.encode('utf-8')
+                json_content = compress(json_content, codec)
+
             blob.upload_from_string(json_content)
 
         except Exception: 
             logger.exception("")
-            
+
+    def write_jsonl(self,
+        records : Iterable,
+        full_gcs_path : str,
+        max_shard_size : int = None,
+        chunk_size : int = DEFAULT_WRITE_CHUNK_SIZE,
+        codec : str = None
+        ) -> List[str]:
+        """Streams records to a JSONL file through a resumable upload, in bounded memory.
+
+        Args:
+            records: dicts (or any JSON value) encoded with orjson when installed, 
+                or str/bytes lines already encoded. Consumed lazily.
+            max_shard_size: when set, rolls over to a new file once a shard holds this 
+                many (uncompressed) bytes; gs://b/train.jsonl becomes gs://b/train-00000.jsonl, ...
+            chunk_size: resumable upload chunk, a multiple of 256 KB.
+            codec: 'gzip' or 'zstd' to store the files compressed.
+        Returns:
+            the GCS paths written, None on failure.
+        """
+
+        paths = list()
+        names = list()
+        writer = None
+        bucket_name = None
+        # shards are written under temporary names, renamed once all the records are in
+        temp_suffix = f".gchelper-tmp-{uuid.uuid4().hex}"
+        try:
+            bucket_name, blob_name = split_gcs_path(full_gcs_path)
+            root, extension = posixpath.splitext(blob_name)
+
+            def open_shard():
+                name = f"{root}-{len(names):05d}{extension}" if max_shard_size else blob_name
+                shard_writer = self.open_writer(bucket_name, name + temp_suffix, chunk_size, 
+                    content_type='application/jsonl', codec=codec)
+                if shard_writer is None:
+                    raise IOError(f"Could not open gs://{bucket_name}/{name}{temp_suffix}")
+                names.append(name)
+                return shard_writer
+
+            writer = open_shard()
+            shard_size = 0
+            for record in records:
+                line = encode_jsonl_line(record)
+                if max_shard_size and shard_size and shard_size + len(line) > max_shard_size:
+                    writer.close()
+                    writer = open_shard()
+                    shard_size = 0
+
+                writer.write(line)
+                shard_size += len(line)
+
+            # closing finalizes the upload
+            writer.close()
+            writer = None
+
+            bucket = self.bucket_cache.get(bucket_name)
+            transfer_manager = TransferManager(self.client)
+            for name in names:
+                # server-side rewrite, keeping the content type and codec metadata
+                result = transfer_manager.copy_blob(bucket.blob(name + temp_suffix), bucket.blob(name))
+                if not result.succeeded:
+                    raise result.error
+                paths.append(f"gs://{bucket_name}/{name}")
+
+            if self.no_logging == False:
+                logger.info(f"Saved jsonl to {', '.join(paths)}")
+
+        except Exception: 
+            # nothing is saved at full_gcs_path from an incomplete record stream
+            logger.exception("")
+            paths = None
+
+        finally:
+            if names:
+                self._discard_temp_shards(bucket_name, [name + temp_suffix for name in names], writer)
+
+        return paths
+
+    def _discard_temp_shards(self,
+        bucket_name : str,
+        temp_names : List[str],
+        writer : IO[bytes]
+        ):
+        '''
+        Deletes the temporary shards of write_jsonl. An open writer is closed
+        first, as the garbage collector would otherwise finalize it later.
+        '''
+
+        if writer is not None:
+            try:
+                writer.close()
+            except Exception:
+                logger.warning("Could not finalize the interrupted jsonl shard", exc_info=True)
+
+        try:
+            bucket = self.bucket_cache.get(bucket_name)
+            bucket.delete_blobs([bucket.blob(name) for name in temp_names], on_error=lambda blob: None)
+        except Exception:
+            logger.exception(f"Could not delete the temporary jsonl shards {', '.join(temp_names)}")
+
     #endregion
 
     #region Delete
 
     def delete(self,
         bucket_name : str,
-        blob_name : str
+        blob_name : str,
+        reload : bool = True
         ):
+        '''
+        reload: False skips the metadata GET made before the delete.
+        '''
    
         try:            
-            bucket = self.client.get_bucket(bucket_name)
-            blob = bucket.get_blob(blob_name)
+            blob = self._get_blob(bucket_name, blob_name, reload)
             blob.delete()
 
         except Exception: 
             logger.exception("")
 
         return 
-    #endregion
\ No newline at end of file
+
+    def delete_many(self,
+        bucket_name : str,
+        blob_names : Iterable[Union[str, Tuple[str, int]]],
+        batch_size : int = MAX_BATCH_SIZE,
+        max_workers : int = DEFAULT_MAX_WORKERS
+        ) -> List[DeleteResult]:
+        """Deletes blobs with batched requests, max_workers batches in flight.
+
+        Args:
+            blob_names: blob names, or (name, generation) pairs to delete a blob only
+                if its live generation still matches. Consumed lazily.
+            batch_size: deletes per batch request, at most 100.
+        Returns:
+            one DeleteResult per blob. Blobs that were already gone count as deleted.
+        """
+
+        results = list()
+        try:
+            bucket = self.client.bucket(bucket_name)
+            items = (
+                (name, None) if isinstance(name, str) else tuple(name)
+                for name in blob_names)
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                chunks = batched(items, min(batch_size, MAX_BATCH_SIZE))
+                for chunk_results in bounded_map(executor, 
+                        lambda chunk: self._delete_batch(bucket, chunk), chunks, 2 * max_workers):
+                    results.extend(chunk_results)
+
+            if self.no_logging == False:
+                failed = [result for result in results if not result.succeeded]
+                logger.info(f"Deleted {len(results) - len(failed)}/{len(results)} blobs from gs://{bucket_name}")
+                for result in failed:
+                    logger.error(f"Failed to delete {result.blob_name}: {result.error}")
+
+        except Exception: 
+            logger.exception("")
+
+        return results
+
+    def delete_prefix(self,
+        bucket_name : str,
+        prefix : str,
+        match_generation : bool = False,
+        batch_size : int = MAX_BATCH_SIZE,
+        max_workers : int = DEFAULT_MAX_WORKERS
+        ) -> List[DeleteResult]:
+        '''
+        Deletes every blob under prefix while the listing is streamed.
+        match_generation: only delete blobs not overwritten since they were listed.
+        '''
+
+        listing = self.iter_blobs(bucket_name, prefix=prefix, fields=('name', 'generation'))
+        blob_names = (
+            (blob.name, blob.generation) if match_generation else blob.name
+            for blob in listing)
+
+        return self.delete_many(bucket_name, blob_names, batch_size=batch_size, max_workers=max_workers)
+
+    def _delete_batch(self,
+        bucket : Bucket,
+        chunk : List[Tuple[str, int]]
+        ) -> List[DeleteResult]:
+
+        try:
+            # client batches are thread-local, each worker sends its own
+            with self.client.batch():
+                for name, generation in chunk:
+                    bucket.delete_blob(name, if_generation_match=generation)
+
+            return [DeleteResult(name, generation) for name, generation in chunk]
+
+        except Exception:
+            logger.debug(f"Batch delete failed, retrying {len(chunk)} blobs one by one")
+
+        # A batch reports its first failure only, the other deletes were applied server-side.
+        results = list()
+        for name, generation in chunk:
+            try:
+                bucket.delete_blob(name, if_generation_match=generation)
+                results.append(DeleteResult(name, generation))
+            except NotFound:
+                results.append(DeleteResult(name, generation))
+            except Exception as e:
+                results.append(DeleteResult(name, generation, e))
+
+        return results
+
+    #endregion
+
+    #region Copy
+
+    def copy_prefix(self,
+        source_bucket : str,
+        source_prefix : str,
+        destination_bucket : str,
+        destination_prefix : str = None,
+        storage_class : str = None,
+        kms_key_name : str = None,
+        max_workers : int = 32
+        ) -> List[CopyResult]:
+        """Copies every blob under source_prefix with server-side rewrites, no data goes through this host.
+
+        The listing is streamed into the copies, unless destination_prefix is
+        inside source_prefix in the same bucket: then the whole listing is
+        taken first, so that the new copies are not copied again.
+
+        Args:
+            destination_prefix: replaces source_prefix in the blob names, defaults to source_prefix.
+            storage_class: e.g. 'NEARLINE', storage class of the copies.
+            kms_key_name: Cloud KMS key encrypting the copies.
+            max_workers: number of concurrent rewrites.
+        Returns:
+            one CopyResult per blob.
+        """
+
+        results = list()
+        try:
+            if destination_prefix is None:
+                destination_prefix = source_prefix
+
+            bucket = self.client.bucket(destination_bucket)
+
+            def destination(blob):
+                copy = bucket.blob(destination_prefix + blob.name[len(source_prefix):], 
+                    kms_key_name=kms_key_name)
+                if storage_class:
+                    copy.storage_class = storage_class
+                return copy
+
+            listing = self.iter_blobs(source_bucket, prefix=source_prefix, fields=('name', 'generation'))
+            if (destination_bucket == source_bucket and destination_prefix != source_prefix
+                    and destination_prefix.startswith(source_prefix)):
+                # the copies land under the listed prefix, they must not be listed and copied again
+                listing = list(listing)
+
+            jobs = ((blob, destination(blob)) for blob in listing)
+
+            transfer_manager = TransferManager(self.client, max_workers=max_workers)
+            results = transfer_manager.copy_many(jobs)
+
+            if self.no_logging == False:
+                failed = [result for result in results if not result.succeeded]
+                logger.info(f"Copied {len(results) - len(failed)}/{len(results)} blobs from "
+                    f"gs://{source_bucket}/{source_prefix} to gs://{destination_bucket}/{destination_prefix}")
+                for result in failed:
+                    logger.error(f"Failed to copy {result.source_name}: {result.error}")
+
+        except Exception: 
+            logger.exception("")
+
+        return results
+
+    def move_prefix(self,
+        source_bucket : str,
+        source_prefix : str,
+        destination_bucket : str,
+        destination_prefix : str = None,
+        storage_class : str = None,
+        kms_key_name : str = None,
+        max_workers : int = 32
+        ) -> List[CopyResult]:
+        '''
+        copy_prefix, then batch deletes of the sources copied successfully. A source
+        overwritten during the copy is kept and its result carries the delete error.
+        A move onto the same bucket and prefix (a storage class or KMS key change)
+        rewrites the blobs in place and deletes nothing.
+        '''
+
+        results = self.copy_prefix(source_bucket, source_prefix, destination_bucket, destination_prefix,
+            storage_class=storage_class, kms_key_name=kms_key_name, max_workers=max_workers)
+
+        if destination_bucket == source_bucket and destination_prefix in (None, source_prefix):
+            # the copies are new generations of the sources, there is nothing left to delete
+            return results
+
+        try:
+            deletes = self.delete_many(source_bucket,
+                [(result.source_name, result.generation) for result in results if result.succeeded],
+                max_workers=max_workers)
+            errors = {delete.blob_name: delete.error for delete in deletes if not delete.succeeded}
+
+            results = [
+                result._replace(error=errors[result.source_name]) if result.source_name in errors else result
+                for result in results]
+
+        except Exception: 
+            logger.exception("")
+
+        return results
+
+    #endregion
+
+    #region Sync
+
+    def sync(self,
+        local_folder : str,
+        bucket_name : str,
+        prefix : str = '',
+        direction : str = 'upload',
+        delete : bool = False,
+        manifest_path : str = None,
+        max_workers : int = DEFAULT_MAX_WORKERS
+        ) -> SyncResult:
+        """Mirrors local_folder to gs://bucket_name/prefix ('upload') or back ('download').
+
+        Files are compared by size, then by CRC32C (present on every object, 
+        composite ones included). Local checksums are kept in a manifest so 
+        that files whose size and mtime did not change are not hashed again. 
+        Only changed files are transferred, in parallel.
+
+        Args:
+            delete: also delete what no longer exists on the source side.
+            manifest_path: defaults to MANIFEST_NAME in local_folder.
+        Returns:
+            a SyncResult, None on failure.
+        """
+
+        result = None
+        try:
+            if direction not in ('upload', 'download'):
+                raise ValueError(f"direction must be 'upload' or 'download', not {direction}")
+
+            manifest_path = manifest_path or os.path.join(local_folder, MANIFEST_NAME)
+            manifest = SyncManifest(manifest_path)
+
+            local_files = dict()
+            for root, _, file_names in os.walk(local_folder):
+                for file_name in file_names:
+                    path = os.path.join(root, file_name)
+                    # only the downloads in progress are skipped, not every .part file
+                    if os.path.abspath(path) == os.path.abspath(manifest_path) or PART_SUFFIX in file_name:
+                        continue
+                    local_files[os.path.relpath(path, local_folder).replace(os.sep, '/')] = path
+
+            # contentEncoding keeps gzip-encoded blobs out of sliced downloads
+            remote_blobs = {
+                blob.name[len(prefix):]: blob
+                for blob in self.iter_blobs(bucket_name, prefix=prefix, fields=LIST_FIELDS + ('contentEncoding',))
+                if not blob.name.endswith('/')}
+
+            local_paths = dict()
+            if direction == 'download':
+                for name in list(remote_blobs):
+                    path = self._sync_local_path(local_folder, name)
+                    if path is None:
+                        logger.warning(f"Skipping gs://{bucket_name}/{prefix}{name}, its name is not a safe path under {local_folder}")
+                        del remote_blobs[name]
+                    else:
+                        local_paths[name] = path
+
+            def compare(relative_name):
+                path = local_files[relative_name]
+                stat = os.stat(path)
+                blob = remote_blobs.get(relative_name)
+                if direction == 'download' and blob is not None and blob.content_encoding:
+                    # size and CRC32C are the ones of the encoded bytes, not of the decoded file
+                    return relative_name, stat, None, not manifest.downloaded_from(relative_name, stat, blob.crc32c)
+                if blob is None or blob.size != stat.st_size:
+                    return relative_name, stat, None, True
+                crc32c = manifest.crc32c(relative_name, path, stat)
+                return relative_name, stat, crc32c, crc32c != blob.crc32c
+
+            if direction == 'upload':
+                candidates = list(local_files)
+            else:
+                candidates = [name for name in remote_blobs if name in local_files]
+
+            changed = list()
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for relative_name, stat, crc32c, is_changed in executor.map(compare, candidates):
+                    manifest.update(relative_name, stat, crc32c)
+                    if is_changed:
+                        changed.append(relative_name)
+
+            transfer_manager = TransferManager(self.client, max_workers=max_workers,
+                retry_policy=self.retry_policy)
+            deleted = list()
+
+            if direction == 'upload':
+                bucket = self.client.bucket(bucket_name)
+                jobs = [
+                    (local_files[name], bucket.blob(prefix + name))
+                    for name in changed]
+                transferred = transfer_manager.upload_many(jobs)
+                for (path, blob), transfer in zip(jobs, transferred):
+                    if transfer.succeeded:
+                        # the upload response carries the CRC32C computed server-side
+                        manifest.update(transfer.blob_name[len(prefix):], os.stat(path), blob.crc32c)
+
+                if delete:
+                    deleted = self.delete_many(bucket_name, 
+                        [blob.name for name, blob in remote_blobs.items() if name not in local_files],
+                        max_workers=max_workers)
+
+            else:
+                changed.extend(name for name in remote_blobs if name not in local_files)
+                jobs = [
+                    (remote_blobs[name], local_paths[name])
+                    for name in changed]
+                transferred = transfer_manager.download_many(jobs)
+                for (blob, path), transfer in zip(jobs, transferred):
+                    if transfer.succeeded and blob.content_encoding:
+                        manifest.update(blob.name[len(prefix):], os.stat(path), None, remote_crc32c=blob.crc32c)
+                    elif transfer.succeeded:
+                        manifest.update(blob.name[len(prefix):], os.stat(path), blob.crc32c)
+
+                if delete:
+                    for name in local_files:
+                        if name in remote_blobs:
+                            continue
+                        try:
+                            os.remove(local_files[name])
+                            deleted.append(DeleteResult(local_files[name]))
+                        except Exception as e:
+                            deleted.append(DeleteResult(local_files[name], error=e))
+                        manifest.remove(name)
+
+            manifest.save()
+
+            result = SyncResult(transferred, deleted, 
+                len(local_files if direction == 'upload' else remote_blobs) - len(changed))
+
+            if self.no_logging == False:
+                failed = [transfer for transfer in transferred if not transfer.succeeded]
+                logger.info(f"Synced {local_folder} {'to' if direction == 'upload' else 'from'} "
+                    f"gs://{bucket_name}/{prefix}: {len(transferred) - len(failed)} transferred, "
+                    f"{len(failed)} failed, {result.unchanged} unchanged, {len(deleted)} deleted")
+
+        except Exception: 
+            logger.exception("")
+
+        return result
+
+    def _sync_local_path(self,
+        local_folder : str,
+        name : str
+        ) -> str:
+        '''
+        Local path of a blob name relative to the synced prefix, None when the
+        name would resolve outside local_folder (.., absolute or empty parts).
+        '''
+
+        parts = name.split('/')
+        if any(part in ('', '.', '..') for part in parts):
+            return None
+
+        root = os.path.realpath(local_folder)
+        path = os.path.realpath(os.path.join(root, *parts))
+        if os.path.commonpath([root, path]) != root or path == root:
+            return None
+
+        return path
+
+    #endregion
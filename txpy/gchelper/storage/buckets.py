@@ -1,14 +1,130 @@
 __version__ = "0.1.0"
 
+import json
 import logging
-import subprocess
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, NamedTuple, Tuple
 
 from google.cloud import storage
+from google.cloud.storage.blob import Blob
 from google.cloud.storage.bucket import Bucket
 from google.api_core.exceptions import Conflict
 
 logger = logging.getLogger(__name__)
 
+# Only what sizing needs; nextPageToken keeps the pagination going.
+SIZE_LIST_FIELDS = 'items(name,size,storageClass),prefixes,nextPageToken'
+
+# Listings kept in flight per worker before sub-prefixes stop being split further.
+SHARDS_PER_WORKER = 4
+
+class PrefixSize(NamedTuple):
+    '''
+    Object counts and bytes per storage class of the blobs under a prefix.
+    '''
+    prefix : str
+    objects : Dict[str, int]
+    size : Dict[str, int]
+    timestamp : float
+
+    @property
+    def total_objects(self) -> int:
+        return sum(self.objects.values())
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(self.size.values())
+
+    def add(self, blob : Blob):
+        storage_class = blob.storage_class or 'STANDARD'
+        self.objects[storage_class] = self.objects.get(storage_class, 0) + 1
+        self.size[storage_class] = self.size.get(storage_class, 0) + (blob.size or 0)
+
+    def merge(self, other : 'PrefixSize'):
+        for storage_class, objects in other.objects.items():
+            self.objects[storage_class] = self.objects.get(storage_class, 0) + objects
+        for storage_class, size in other.size.items():
+            self.size[storage_class] = self.size.get(storage_class, 0) + size
+
+
+class BucketSize(NamedTuple):
+    '''
+    Result of Buckets.size_bucket, keyed by prefix.
+    '''
+    bucket_name : str
+    prefixes : Dict[str, PrefixSize]
+
+    @property
+    def total_objects(self) -> int:
+        return sum(prefix_size.total_objects for prefix_size in self.prefixes.values())
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(prefix_size.total_bytes for prefix_size in self.prefixes.values())
+
+    def size_by_storage_class(self) -> Dict[str, int]:
+        totals = dict()
+        for prefix_size in self.prefixes.values():
+            for storage_class, size in prefix_size.size.items():
+                totals[storage_class] = totals.get(storage_class, 0) + size
+        return totals
+
+
+class BucketCache:
+    '''
+    Thread-safe cache of bucket handles fetched with client.get_bucket.
+
+    Entries expire after ttl seconds; beyond max_size buckets the least
+    recently used handle is evicted.
+    '''
+
+    def __init__(self,
+        client : storage.Client,
+        ttl : float = 300.0,
+        max_size : int = 128
+        ):
+
+        self.client = client
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, bucket_name : str) -> Bucket:
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(bucket_name)
+            if entry and now - entry[1] < self.ttl:
+                self._entries.move_to_end(bucket_name)
+                return entry[0]
+
+        # fetched outside the lock: a concurrent miss costs one extra GET, not a stall
+        bucket = self.client.get_bucket(bucket_name)
+
+        with self._lock:
+            self._entries[bucket_name] = (bucket, now)
+            self._entries.move_to_end(bucket_name)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+        return bucket
+
+    def invalidate(self, bucket_name : str = None):
+        """Drops one bucket, or all buckets when bucket_name is None."""
+
+        with self._lock:
+            if bucket_name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(bucket_name, None)
+
+
 class Buckets:
 
     def __init__(self, 
@@ -81,15 +197,145 @@ class Buckets:
         except Exception: 
             logger.exception("")
     
-    def size_bucket(self, bucket_name : str):
+    def size_bucket(self, 
+        bucket_name : str,
+        prefix : str = '',
+        max_workers : int = 8,
+        snapshot_path : str = None,
+        max_age : float = 0
+        ) -> BucketSize:
+        """Computes object counts and bytes per storage class for each sub-prefix of prefix.
+
+        The direct sub-prefixes of prefix ('a/', 'b/', ...) are sized by concurrent 
+        listing workers requesting only name, size and storage class. While there
+        are fewer than SHARDS_PER_WORKER listings per worker, sub-prefixes are
+        split further into their own sub-prefixes, so that a bucket with a
+        handful of huge top-level prefixes still keeps every worker busy.
+
+        Args:
+            snapshot_path: optional JSON file with the result of a previous run.
+            max_age: sub-prefixes sized less than max_age seconds ago in the
+                snapshot are reused instead of listed again.
+        Returns:
+            a BucketSize, or None on failure.
+        """
 
         try:
-            subprocess.run(
-                f"gsutil du -s  gs://{bucket_name}", shell=True)
+            snapshot = self._load_size_snapshot(snapshot_path, bucket_name)
+
+            # One delimited listing sizes the objects directly under prefix and 
+            # yields the shards.
+            root, shards = self._size_prefix(bucket_name, prefix, split=True)
+
+            prefixes = {prefix: root}
+            stale = list()
+            for shard in sorted(shards):
+                cached = snapshot.get(shard)
+                if cached and time.time() - cached.timestamp < max_age:
+                    prefixes[shard] = cached
+                else:
+                    stale.append(shard)
+
+            target = max_workers * SHARDS_PER_WORKER
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # each listing is credited to the shard it was split from
+                pending = dict()
+                for shard in stale:
+                    prefixes[shard] = PrefixSize(shard, {}, {}, time.time())
+                    pending[executor.submit(self._size_prefix, bucket_name, shard, len(stale) < target)] = shard
+
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        shard = pending.pop(future)
+                        prefix_size, sub_prefixes = future.result()
+                        prefixes[shard].merge(prefix_size)
+
+                        split = len(pending) + len(sub_prefixes) < target
+                        for sub_prefix in sub_prefixes:
+                            pending[executor.submit(self._size_prefix, bucket_name, sub_prefix, split)] = shard
+
+            bucket_size = BucketSize(bucket_name, dict(sorted(prefixes.items())))
+
+            if snapshot_path:
+                self._save_size_snapshot(snapshot_path, bucket_size)
+
+            logger.info(f"gs://{bucket_name}/{prefix}: {bucket_size.total_objects} objects, "
+                f"{bucket_size.total_bytes} bytes ({len(stale)}/{len(shards)} prefixes listed)")
+            for storage_class, size in bucket_size.size_by_storage_class().items():
+                logger.info(f"  {storage_class}: {size} bytes")
+
+            return bucket_size
 
         except Exception: 
             logger.exception("")
 
+        return None
+
+    def _size_prefix(self,
+        bucket_name : str,
+        prefix : str,
+        split : bool = False
+        ) -> Tuple[PrefixSize, List[str]]:
+        '''
+        Sizes the whole prefix, or when split only the objects directly under
+        it, returning its sub-prefixes to be sized separately.
+        '''
+
+        prefix_size = PrefixSize(prefix, {}, {}, time.time())
+        if not split:
+            for blob in self.client.list_blobs(bucket_name, prefix=prefix, fields=SIZE_LIST_FIELDS):
+                prefix_size.add(blob)
+            return prefix_size, []
+
+        sub_prefixes = list()
+        iterator = self.client.list_blobs(bucket_name, 
+            prefix=prefix, 
+            delimiter='/', 
+            fields=SIZE_LIST_FIELDS)
+        for page in iterator.pages:
+            for blob in page:
+                prefix_size.add(blob)
+            sub_prefixes.extend(page.prefixes)
+
+        return prefix_size, sub_prefixes
+
+    def _load_size_snapshot(self,
+        snapshot_path : str,
+        bucket_name : str
+        ) -> Dict[str, PrefixSize]:
+
+        if not snapshot_path or not os.path.exists(snapshot_path):
+            return {}
+
+        with open(snapshot_path, 'r') as f:
+            snapshot = json.load(f)
+
+        if snapshot.get('bucket_name') != bucket_name:
+            logger.warning(f"Ignoring snapshot {snapshot_path} of bucket {snapshot.get('bucket_name')}")
+            return {}
+
+        return {
+            prefix: PrefixSize(**prefix_size) 
+            for prefix, prefix_size in snapshot['prefixes'].items()}
+
+    def _save_size_snapshot(self,
+        snapshot_path : str,
+        bucket_size : BucketSize
+        ):
+
+        snapshot = {
+            'bucket_name': bucket_size.bucket_name,
+            'prefixes': {
+                prefix: prefix_size._asdict() 
+                for prefix, prefix_size in bucket_size.prefixes.items()}
+            }
+
+        temp_path = f"{snapshot_path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(temp_path, snapshot_path)
+
     def log_bucket_info(self, bucket : storage.bucket):
         logger.info("ID: {}".format(bucket.id))
         logger.info("Name: {}".format(bucket.name))
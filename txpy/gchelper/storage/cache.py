@@ -0,0 +1,199 @@
+import contextlib
+import hashlib
+import logging
+import os
+import tempfile
+import time
+
+from typing import Callable, IO, Iterator
+
+try:
+    import fcntl
+except ImportError: # not available on Windows, eviction is then not serialized across processes
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 10 * 1024 * 1024 * 1024
+
+# temp files older than this are leftovers of crashed writers
+STALE_TEMP_AGE = 3600
+
+# eviction goes below max_bytes, so that a full cache is not scanned on every put
+EVICTION_TARGET = 0.9
+
+# running total of the cached bytes, shared by the processes using the directory
+TOTAL_FILE = '.total'
+
+class DiskCache:
+    '''
+    Local cache of blob contents keyed by bucket, name and generation.
+
+    Entries are written to a temp file and renamed into place, so readers never
+    see partial content. Hits refresh the file mtime; when the cache grows over
+    max_bytes the least recently used entries are deleted. Several processes
+    may share the directory: eviction runs under an exclusive file lock and a
+    reader losing an entry to eviction sees a miss.
+
+    A put only updates a running total of the cached bytes; the directory is
+    scanned when that total goes over max_bytes, and the scan then brings the
+    cache down to EVICTION_TARGET of max_bytes and corrects the total.
+    '''
+
+    def __init__(self,
+        directory : str,
+        max_bytes : int = DEFAULT_CACHE_SIZE
+        ):
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self,
+        bucket_name : str,
+        blob_name : str,
+        generation : int
+        ) -> str:
+
+        key = hashlib.sha256(f"{bucket_name}/{blob_name}".encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key[:2], f"{key}-{generation}")
+
+    def open(self,
+        bucket_name : str,
+        blob_name : str,
+        generation : int
+        ) -> IO[bytes]:
+        '''
+        Returns the cached content opened for reading, or None on a miss.
+        '''
+
+        path = self.path(bucket_name, blob_name, generation)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # evicted meanwhile; the open handle still reads the content
+            pass
+
+        return f
+
+    def put(self,
+        bucket_name : str,
+        blob_name : str,
+        generation : int,
+        download : Callable[[IO[bytes]], None]
+        ) -> str:
+        """Fills an entry and returns its path.
+
+        Args:
+            download: writes the blob content into the file object it is given.
+        """
+
+        path = self.path(bucket_name, blob_name, generation)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        fd, temp_path = tempfile.mkstemp(prefix='.tmp-', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                download(f)
+            added = os.path.getsize(temp_path) - self._size(path)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        # older generations of the blob are dead entries
+        prefix = os.path.basename(path).rsplit('-', 1)[0] + '-'
+        for entry in os.scandir(directory):
+            if entry.name.startswith(prefix) and entry.path != path:
+                added -= self._size(entry.path)
+                self._remove(entry.path)
+
+        with self._locked():
+            total = self._read_total()
+            if total is None or total + added > self.max_bytes:
+                self._evict_locked()
+            else:
+                self._write_total(total + added)
+
+        return path
+
+    def evict(self):
+        """Deletes least recently used entries until the cache fits in max_bytes."""
+
+        with self._locked():
+            self._evict_locked()
+
+    @contextlib.contextmanager
+    def _locked(self) -> Iterator[None]:
+
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _evict_locked(self):
+        '''
+        Scans the cache, deletes least recently used entries down to
+        EVICTION_TARGET of max_bytes when over max_bytes, and saves the total.
+        '''
+
+        now = time.time()
+        entries = list()
+        total = 0
+        for directory in os.scandir(self.directory):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.startswith('.tmp-'):
+                    if now - stat.st_mtime > STALE_TEMP_AGE:
+                        self._remove(entry.path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        if total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes * EVICTION_TARGET:
+                    break
+                self._remove(path)
+                total -= size
+
+        self._write_total(total)
+
+    def _read_total(self) -> int:
+
+        try:
+            with open(os.path.join(self.directory, TOTAL_FILE), 'r') as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_total(self, total : int):
+
+        with open(os.path.join(self.directory, TOTAL_FILE), 'w') as f:
+            f.write(str(max(0, total)))
+
+    def _size(self, path : str) -> int:
+
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+
+    def _remove(self, path : str):
+
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
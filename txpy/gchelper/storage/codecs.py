@@ -0,0 +1,108 @@
+import gzip
+import logging
+
+from typing import IO
+
+from google.cloud.storage.blob import Blob
+
+try:
+    import zstandard
+except ImportError: # optional, pip install txpy-gchelper[zstd]
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+
+# Custom metadata recording the codec of a blob. gzip blobs also get the
+# standard Content-Encoding: gzip, which Cloud Storage understands
+# (decompressive transcoding); zstd is only known to this library.
+CODEC_METADATA_KEY = 'gchelper-codec'
+
+DEFAULT_LEVELS = {GZIP: 6, ZSTD: 3}
+
+def _check(codec : str):
+
+    if codec not in (GZIP, ZSTD):
+        raise ValueError(f"Unsupported codec {codec}, use '{GZIP}' or '{ZSTD}'")
+    if codec == ZSTD and zstandard is None:
+        raise ImportError("The zstd codec requires the zstandard package")
+
+def set_codec(blob : Blob, codec : str):
+    '''
+    Sets the metadata of a blob about to be uploaded compressed with codec.
+    '''
+
+    _check(codec)
+    blob.metadata = {**(blob.metadata or {}), CODEC_METADATA_KEY: codec}
+    if codec == GZIP:
+        blob.content_encoding = GZIP
+
+def get_codec(blob : Blob) -> str:
+    '''
+    Returns the codec of a blob with its metadata loaded, None if it is not compressed.
+    '''
+
+    codec = (blob.metadata or {}).get(CODEC_METADATA_KEY)
+    if codec is None and blob.content_encoding == GZIP:
+        codec = GZIP
+
+    return codec
+
+def compress(data : bytes, codec : str, level : int = None) -> bytes:
+
+    _check(codec)
+    level = level or DEFAULT_LEVELS[codec]
+    if codec == GZIP:
+        return gzip.compress(data, compresslevel=level)
+
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+def decompress(data : bytes, codec : str) -> bytes:
+
+    _check(codec)
+    if codec == GZIP:
+        return gzip.decompress(data)
+
+    # stream decompression handles frames written without the content size
+    return zstandard.ZstdDecompressor().stream_reader(data).read()
+
+def compressing_writer(raw : IO[bytes], codec : str, level : int = None) -> IO[bytes]:
+    '''
+    Wraps a binary writer so that data is compressed as it is written.
+    Closing the returned writer flushes the codec and closes raw.
+    '''
+
+    _check(codec)
+    level = level or DEFAULT_LEVELS[codec]
+    if codec == GZIP:
+        return _GzipFile(fileobj=raw, mode='wb', compresslevel=level)
+
+    return zstandard.ZstdCompressor(level=level).stream_writer(raw)
+
+def decompressing_reader(raw : IO[bytes], codec : str) -> IO[bytes]:
+    '''
+    Wraps a binary reader so that data is decompressed incrementally as it is read.
+    Closing the returned reader closes raw.
+    '''
+
+    _check(codec)
+    if codec == GZIP:
+        return _GzipFile(fileobj=raw, mode='rb')
+
+    return zstandard.ZstdDecompressor().stream_reader(raw)
+
+
+class _GzipFile(gzip.GzipFile):
+    '''
+    GzipFile that also closes the file object it wraps.
+    '''
+
+    def close(self):
+        fileobj = self.fileobj
+        try:
+            super().close()
+        finally:
+            if fileobj is not None:
+                fileobj.close()
@@ -0,0 +1,51 @@
+import itertools
+
+from collections import deque
+from concurrent.futures import Executor, as_completed, wait, FIRST_COMPLETED
+from typing import Callable, Iterable, Iterator, List, Union
+
+def batched(items : Iterable, size : int) -> Iterator[List]:
+    '''
+    Yields lists of size items (the last one shorter), consuming items lazily.
+    '''
+
+    items = iter(items)
+    return iter(lambda: list(itertools.islice(items, size)), [])
+
+def bounded_map(
+    executor : Executor,
+    func : Callable,
+    items : Iterable,
+    window : Union[int, Callable[[], int]],
+    ordered : bool = True
+    ) -> Iterator:
+    '''
+    Lazy counterpart of executor.map: items are only consumed as calls
+    complete, with at most window calls in flight, so that a streamed
+    listing is never fully materialized. Yields the results of func(item)
+    in the order of items, or as the calls complete when not ordered.
+
+    window: a number of calls, or a function returning it, read before each call.
+    '''
+
+    limit = window if callable(window) else lambda: window
+
+    in_flight = deque()
+    for item in items:
+        while len(in_flight) >= max(1, limit()):
+            if ordered:
+                yield in_flight.popleft().result()
+            else:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    in_flight.remove(future)
+                    yield future.result()
+
+        in_flight.append(executor.submit(func, item))
+
+    if ordered:
+        while in_flight:
+            yield in_flight.popleft().result()
+    else:
+        for future in as_completed(in_flight):
+            yield future.result()
@@ -0,0 +1,43 @@
+import json
+
+from typing import IO, Iterator
+
+try:
+    import orjson
+except ImportError: # optional, pip install txpy-gchelper[orjson]
+    orjson = None
+
+LINE_READ_SIZE = 1024 * 1024
+
+def encode_jsonl_line(record) -> bytes:
+    '''
+    Encodes a record (dict, list, ...) as one JSONL line. str and bytes 
+    records are taken as already encoded lines.
+    '''
+
+    if isinstance(record, bytes):
+        line = record
+    elif isinstance(record, str):
+        line = record.encode('utf-8')
+    elif orjson is not None:
+        line = orjson.dumps(record)
+    else:
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    return line if line.endswith(b'\n') else line + b'\n'
+
+def iter_lines(reader : IO[bytes], chunk_size : int = LINE_READ_SIZE) -> Iterator[bytes]:
+    '''
+    Yields the lines of a binary reader without their newline, reading
+    chunk_size bytes at a time: unbuffered readers such as BlobReader
+    would otherwise serve readline one byte per call.
+    '''
+
+    pending = b''
+    for chunk in iter(lambda: reader.read(chunk_size), b''):
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        yield from lines
+
+    if pending:
+        yield pending
@@ -0,0 +1,15 @@
+import re
+
+from typing import Tuple
+
+def split_gcs_path(full_gcs_path : str) -> Tuple[str, str]:
+    '''
+    Splits gs://bucket/name into (bucket, name), name being '' for gs://bucket.
+    Raises ValueError for anything else.
+    '''
+
+    match = re.match(r"gs://([^/]+)/?(.*)", full_gcs_path or '')
+    if not match:
+        raise ValueError(f"Invalid GCS path {full_gcs_path}")
+
+    return match.group(1), match.group(2)
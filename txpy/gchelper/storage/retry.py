@@ -0,0 +1,167 @@
+import logging
+import random
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+
+from google.api_core import exceptions
+from google.auth.exceptions import TransportError
+
+logger = logging.getLogger(__name__)
+
+# Errors worth another attempt: throttling, server-side failures and broken connections,
+# from HTTP and gRPC clients.
+RETRYABLE_ERRORS = (
+    exceptions.TooManyRequests,
+    exceptions.ResourceExhausted,
+    exceptions.DeadlineExceeded,
+    exceptions.InternalServerError,
+    exceptions.BadGateway,
+    exceptions.ServiceUnavailable,
+    exceptions.GatewayTimeout,
+    ConnectionError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    TransportError
+)
+
+def is_retryable(error : Exception) -> bool:
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+class RetryPolicy:
+    '''
+    Exponential backoff with full jitter: the n-th retry waits a random time
+    between 0 and min(initial * multiplier^n, maximum) seconds. Gives up when
+    the next wait would end past deadline seconds after the first attempt.
+    '''
+
+    def __init__(self,
+        initial : float = 0.1,
+        maximum : float = 10.0,
+        multiplier : float = 2.0,
+        deadline : float = 60.0,
+        predicate = is_retryable
+        ):
+
+        self.initial = initial
+        self.maximum = maximum
+        self.multiplier = multiplier
+        self.deadline = deadline
+        self.predicate = predicate
+
+    def call(self, func, *args, **kwargs):
+
+        start_time = time.monotonic()
+        delay = self.initial
+        attempt = 1
+        while True:
+            try:
+                return func(*args, **kwargs)
+
+            except Exception as e:
+                if not self.predicate(e):
+                    raise
+
+                sleep = random.uniform(0, delay)
+                if time.monotonic() - start_time + sleep > self.deadline:
+                    raise
+
+                logger.warning(f"Attempt {attempt} failed with {type(e).__name__}, retrying in {sleep:.2f}s")
+                time.sleep(sleep)
+                delay = min(delay * self.multiplier, self.maximum)
+                attempt += 1
+
+
+class HedgePolicy:
+    '''
+    Hedged requests: when a call has not returned after the quantile of the
+    latencies observed so far, the same call is sent a second time and the
+    first successful answer wins. The losing request runs to completion in
+    the background; only idempotent reads should be hedged.
+
+    The delay is counted from the moment the first request actually starts,
+    not from when it was queued, so a saturated pool does not hedge every
+    call; and at most budget of the calls are hedged.
+    '''
+
+    def __init__(self,
+        quantile : float = 0.95,
+        initial_delay : float = 0.2,
+        min_delay : float = 0.01,
+        window : int = 1000,
+        max_workers : int = 64,
+        budget : float = 0.05
+        ):
+        '''
+        budget: largest fraction of the calls that may be hedged.
+        '''
+
+        self.quantile = quantile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.budget = budget
+        self.calls = 0
+        self.hedges = 0
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def delay(self) -> float:
+        '''
+        Seconds to wait before hedging, initial_delay until enough latencies were seen.
+        '''
+
+        with self._lock:
+            if len(self._latencies) < 20:
+                return self.initial_delay
+            latencies = sorted(self._latencies)
+
+        return max(self.min_delay, latencies[int(self.quantile * (len(latencies) - 1))])
+
+    def call(self, func, *args, **kwargs):
+
+        with self._lock:
+            self.calls += 1
+
+        started = threading.Event()
+        start_times = []
+
+        def primary():
+            start_times.append(time.monotonic())
+            started.set()
+            return func(*args, **kwargs)
+
+        pending = {self._executor.submit(primary)}
+
+        # time spent queued behind other calls does not count toward the delay
+        started.wait()
+        start_time = start_times[0]
+        done, _ = wait(pending, timeout=max(0.0, start_time + self.delay() - time.monotonic()))
+        if not done and self._take_hedge():
+            logger.debug(f"Hedging {getattr(func, '__name__', func)} after {time.monotonic() - start_time:.3f}s")
+            pending.add(self._executor.submit(func, *args, **kwargs))
+
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    with self._lock:
+                        self._latencies.append(time.monotonic() - start_time)
+                    return future.result()
+                error = future.exception()
+
+        raise error
+
+    def _take_hedge(self) -> bool:
+
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.calls:
+                return False
+            self.hedges += 1
+            return True
@@ -0,0 +1,106 @@
+import json
+import logging
+import os
+
+from typing import Dict, List, NamedTuple
+
+from .transfer import TransferResult, compute_crc32c
+
+logger = logging.getLogger(__name__)
+
+# Default manifest file, kept in the synced folder and never transferred.
+MANIFEST_NAME = '.gchelper-sync.json'
+
+class SyncResult(NamedTuple):
+    '''
+    Outcome of Blobs.sync. deleted holds DeleteResults of blobs (upload)
+    or of local file names (download).
+    '''
+    transferred : List[TransferResult]
+    deleted : list
+    unchanged : int
+
+
+class SyncManifest:
+    '''
+    Local record of the size, mtime and CRC32C of the synced files,
+    so that unchanged files are not hashed again.
+    '''
+
+    def __init__(self, path : str):
+
+        self.path = path
+        self.entries : Dict[str, dict] = {}
+
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                logger.warning(f"Ignoring corrupt sync manifest {path}")
+
+    def crc32c(self,
+        relative_name : str,
+        file_name : str,
+        stat : os.stat_result
+        ) -> str:
+
+        entry = self._entry(relative_name, stat)
+        if entry and 'crc32c' in entry:
+            return entry['crc32c']
+
+        return compute_crc32c(file_name)
+
+    def downloaded_from(self,
+        relative_name : str,
+        stat : os.stat_result,
+        remote_crc32c : str
+        ) -> bool:
+        '''
+        Whether the file is unchanged since it was downloaded from a content-encoded
+        blob with this CRC32C. The CRC32C of such a blob is the one of its stored,
+        encoded bytes, it cannot be compared with the decoded file.
+        '''
+
+        entry = self._entry(relative_name, stat)
+        return bool(entry and entry.get('remote_crc32c') == remote_crc32c)
+
+    def update(self,
+        relative_name : str,
+        stat : os.stat_result,
+        crc32c : str,
+        remote_crc32c : str = None
+        ):
+        '''
+        remote_crc32c: for a file downloaded from a content-encoded blob, the CRC32C
+            of the blob, see downloaded_from.
+        '''
+
+        if remote_crc32c:
+            self.entries[relative_name] = {
+                'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'remote_crc32c': remote_crc32c}
+        elif crc32c:
+            self.entries[relative_name] = {
+                'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'crc32c': crc32c}
+
+    def remove(self, relative_name : str):
+
+        self.entries.pop(relative_name, None)
+
+    def _entry(self,
+        relative_name : str,
+        stat : os.stat_result
+        ) -> dict:
+
+        entry = self.entries.get(relative_name)
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry
+
+        return None
+
+    def save(self):
+
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(temp_path, self.path)
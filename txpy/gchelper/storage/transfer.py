@@ -0,0 +1,442 @@
+import base64
+import logging
+import math
+import mimetypes
+import os
+import time
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Iterable, List, NamedTuple, Tuple
+
+import google_crc32c
+
+from google.cloud import storage
+from google.cloud.storage.blob import Blob
+
+from .concurrency import bounded_map
+from .retry import RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_SLICED_THRESHOLD = 64 * 1024 * 1024
+DEFAULT_SLICE_SIZE = 16 * 1024 * 1024
+DEFAULT_COMPOSITE_THRESHOLD = 150 * 1024 * 1024
+DEFAULT_COMPOSITE_PART_SIZE = 50 * 1024 * 1024
+
+# Cloud Storage accepts at most 32 source objects per compose request.
+MAX_COMPOSE_COMPONENTS = 32
+
+# Downloads are written to <file name><PART_SUFFIX>-<uuid> and renamed once complete.
+PART_SUFFIX = '.gchelper-part'
+
+# Read size when hashing local files.
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+
+def compute_crc32c(file_name : str) -> str:
+    '''
+    Returns the CRC32C of a local file, base64-encoded like Blob.crc32c.
+    '''
+
+    checksum = google_crc32c.Checksum()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            checksum.update(block)
+
+    return base64.b64encode(checksum.digest()).decode('utf-8')
+
+
+class TransferResult(NamedTuple):
+    '''
+    Outcome of a single object transfer. error is None when the transfer succeeded.
+    '''
+    blob_name : str
+    file_name : str
+    size : int = 0
+    elapsed : float = 0.0
+    error : Exception = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+class CopyResult(NamedTuple):
+    '''
+    Outcome of a single server-side copy. error is None when the copy succeeded.
+    '''
+    source_name : str
+    destination_name : str
+    generation : int = None
+    size : int = 0
+    elapsed : float = 0.0
+    error : Exception = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+class TransferManager:
+    '''
+    In-process transfer engine running on a bounded thread pool.
+
+    Objects bigger than sliced_threshold are fetched as concurrent byte ranges
+    of slice_size written in place into a pre-sized local file.
+
+    Downloads (whole files, slices and ranges) are retried with retry_policy
+    when set, each attempt starting over its own range.
+
+    Files bigger than composite_threshold are uploaded as parallel composite
+    uploads: parts of composite_part_size are uploaded concurrently as temporary
+    objects, composed server-side into the destination and then deleted.
+    '''
+
+    def __init__(self,
+        client : storage.Client,
+        max_workers : int = DEFAULT_MAX_WORKERS,
+        sliced_threshold : int = DEFAULT_SLICED_THRESHOLD,
+        slice_size : int = DEFAULT_SLICE_SIZE,
+        composite_threshold : int = DEFAULT_COMPOSITE_THRESHOLD,
+        composite_part_size : int = DEFAULT_COMPOSITE_PART_SIZE,
+        retry_policy : RetryPolicy = None
+        ):
+
+        self.client = client
+        self.max_workers = max_workers
+        self.sliced_threshold = sliced_threshold
+        self.slice_size = slice_size
+        self.composite_threshold = composite_threshold
+        self.composite_part_size = composite_part_size
+        self.retry_policy = retry_policy
+
+    #region Download
+
+    def download_many(self,
+        jobs : Iterable[Tuple[Blob, str]]
+        ) -> List[TransferResult]:
+        """Downloads (blob, file_name) pairs concurrently.
+
+        Args:
+            jobs: pairs of listed blobs (size and generation known) and local file names.
+        Returns:
+            one TransferResult per job, in job order.
+        """
+
+        # Slices run on their own pool: file workers wait on slices, never the reverse.
+        with ThreadPoolExecutor(max_workers=self.max_workers) as file_executor, \
+             ThreadPoolExecutor(max_workers=self.max_workers) as slice_executor:
+
+            futures = [
+                file_executor.submit(self.download_blob, blob, file_name, slice_executor)
+                for blob, file_name in jobs]
+
+            return [future.result() for future in futures]
+
+    def download_blob(self,
+        blob : Blob,
+        file_name : str,
+        slice_executor : ThreadPoolExecutor = None
+        ) -> TransferResult:
+
+        start_time = time.monotonic()
+        size = blob.size or 0
+        part_name = f"{file_name}{PART_SUFFIX}-{uuid.uuid4().hex}"
+        try:
+            os.makedirs(os.path.dirname(file_name) or '.', exist_ok=True)
+
+            # ranges of a gzip-encoded blob cannot be decoded independently
+            if slice_executor and size > self.sliced_threshold and not blob.content_encoding:
+                self._download_sliced(blob, part_name, slice_executor)
+            else:
+                self._retry(self._download_whole, blob, part_name)
+
+            os.replace(part_name, file_name)
+
+        except Exception as e:
+            logger.exception(f"Download of {blob.name} failed")
+            if os.path.exists(part_name):
+                os.remove(part_name)
+            return TransferResult(blob.name, file_name, size, time.monotonic() - start_time, e)
+
+        return TransferResult(blob.name, file_name, size, time.monotonic() - start_time)
+
+    def _download_whole(self,
+        blob : Blob,
+        part_name : str
+        ):
+
+        with open(part_name, 'wb') as f:
+            blob.download_to_file(f)
+
+    def _download_sliced(self,
+        blob : Blob,
+        part_name : str,
+        slice_executor : ThreadPoolExecutor
+        ):
+
+        with open(part_name, 'wb') as f:
+            f.truncate(blob.size)
+
+        futures = [
+            slice_executor.submit(self._retry, self._download_slice, blob, part_name, start,
+                min(start + self.slice_size, blob.size) - 1)
+            for start in range(0, blob.size, self.slice_size)]
+
+        wait(futures)
+        for future in futures:
+            # re-raise the first slice failure
+            future.result()
+
+        # the slices are not checked individually, the whole file is
+        self._check_crc32c(blob, compute_crc32c(part_name))
+
+    def _download_slice(self,
+        blob : Blob,
+        part_name : str,
+        start : int,
+        end : int
+        ):
+
+        # Pin the generation so that every slice reads the same object version.
+        slice_blob = blob.bucket.blob(blob.name, generation=blob.generation)
+        with open(part_name, 'r+b') as f:
+            f.seek(start)
+            slice_blob.download_to_file(f, start=start, end=end)
+
+    def download_to_buffer(self,
+        blob : Blob,
+        buffer
+        ) -> int:
+        """Downloads the blob straight into a writable buffer, without intermediate copies.
+
+        Args:
+            blob: a blob with its metadata (size, generation and content encoding known),
+                not stored with a content encoding such as gzip.
+            buffer: any writable C-contiguous object supporting the buffer protocol
+                (bytearray, memoryview, mmap, numpy array) of at least blob.size bytes.
+        Returns:
+            the number of bytes written.
+        """
+
+        if blob.content_encoding:
+            # ranges would address the stored, compressed bytes
+            raise ValueError(f"{blob.name} is stored with {blob.content_encoding} content encoding, "
+                "download it with download_as_bytes or open_reader")
+
+        view = memoryview(buffer)
+        if view.readonly:
+            raise ValueError("buffer is read-only")
+        view = view.cast('B')
+
+        size = blob.size or 0
+        if view.nbytes < size:
+            raise ValueError(f"buffer of {view.nbytes} bytes is too small for {blob.name} ({size} bytes)")
+
+        ranges = [
+            (start, min(start + self.slice_size, size) - 1)
+            for start in range(0, size, self.slice_size)]
+
+        if len(ranges) > 1:
+            # each worker fills its own slice of the buffer
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(ranges))) as executor:
+                futures = [
+                    executor.submit(self._retry, self._download_range, blob, view, start, end)
+                    for start, end in ranges]
+                for future in futures:
+                    future.result()
+        elif ranges:
+            self._retry(self._download_range, blob, view, 0, size - 1)
+
+        # range reads are not checksummed by the client; the C extension only
+        # takes bytes, hence the copy of one block at a time
+        checksum = google_crc32c.Checksum()
+        for start in range(0, size, HASH_BLOCK_SIZE):
+            checksum.update(view[start:min(start + HASH_BLOCK_SIZE, size)].tobytes())
+        self._check_crc32c(blob, base64.b64encode(checksum.digest()).decode('utf-8'))
+
+        return size
+
+    def _check_crc32c(self,
+        blob : Blob,
+        crc32c : str
+        ):
+
+        if blob.crc32c is None:
+            blob.reload()
+        if crc32c != blob.crc32c:
+            raise IOError(f"CRC32C mismatch for {blob.name}: {crc32c} downloaded, {blob.crc32c} expected")
+
+    def _download_range(self,
+        blob : Blob,
+        view : memoryview,
+        start : int,
+        end : int
+        ):
+
+        range_blob = blob.bucket.blob(blob.name, generation=blob.generation)
+        range_blob.download_to_file(_BufferWriter(view[start:end + 1]), start=start, end=end)
+
+    def _retry(self, func, *args):
+
+        if self.retry_policy:
+            return self.retry_policy.call(func, *args)
+
+        return func(*args)
+
+    #endregion
+
+    #region Copy
+
+    def copy_many(self,
+        jobs : Iterable[Tuple[Blob, Blob]]
+        ) -> List[CopyResult]:
+        """Rewrites (source, destination) pairs server-side, max_workers at a time.
+
+        Args:
+            jobs: listed source blobs (generation known) and destination blobs, consumed
+                lazily. Properties set on a destination (storage_class, kms_key_name)
+                are applied by the rewrite.
+        Returns:
+            one CopyResult per job, in job order.
+        """
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(bounded_map(executor, lambda job: self.copy_blob(*job), jobs, 2 * self.max_workers))
+
+    def copy_blob(self,
+        source : Blob,
+        destination : Blob
+        ) -> CopyResult:
+
+        start_time = time.monotonic()
+        try:
+            # Pin the generation so that every rewrite call copies the same object version.
+            source = source.bucket.blob(source.name, generation=source.generation)
+
+            # Big objects, or changes of location, storage class or key, take 
+            # several calls chained with a continuation token.
+            token, _, total_bytes = destination.rewrite(source)
+            while token is not None:
+                token, _, total_bytes = destination.rewrite(source, token=token)
+
+        except Exception as e:
+            logger.exception(f"Copy of {source.name} failed")
+            return CopyResult(source.name, destination.name, source.generation, 0,
+                time.monotonic() - start_time, e)
+
+        return CopyResult(source.name, destination.name, source.generation, total_bytes,
+            time.monotonic() - start_time)
+
+    #endregion
+
+    #region Upload
+
+    def upload_many(self,
+        jobs : Iterable[Tuple[str, Blob]]
+        ) -> List[TransferResult]:
+        """Uploads (file_name, blob) pairs concurrently.
+
+        Returns:
+            one TransferResult per job, in job order.
+        """
+
+        # Parts run on their own pool: file workers wait on parts, never the reverse.
+        with ThreadPoolExecutor(max_workers=self.max_workers) as file_executor, \
+             ThreadPoolExecutor(max_workers=self.max_workers) as part_executor:
+
+            futures = [
+                file_executor.submit(self.upload_blob, file_name, blob, part_executor)
+                for file_name, blob in jobs]
+
+            return [future.result() for future in futures]
+
+    def upload_blob(self,
+        file_name : str,
+        blob : Blob,
+        part_executor : ThreadPoolExecutor = None
+        ) -> TransferResult:
+
+        start_time = time.monotonic()
+        size = 0
+        try:
+            size = os.path.getsize(file_name)
+
+            if size > self.composite_threshold:
+                if part_executor:
+                    self._upload_composite(file_name, blob, size, part_executor)
+                else:
+                    with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                        self._upload_composite(file_name, blob, size, executor)
+            else:
+                blob.upload_from_filename(file_name)
+
+        except Exception as e:
+            logger.exception(f"Upload of {file_name} failed")
+            return TransferResult(blob.name, file_name, size, time.monotonic() - start_time, e)
+
+        return TransferResult(blob.name, file_name, size, time.monotonic() - start_time)
+
+    def _upload_composite(self,
+        file_name : str,
+        blob : Blob,
+        size : int,
+        part_executor : ThreadPoolExecutor
+        ):
+
+        # grow the parts so that a single compose request is enough
+        part_size = max(self.composite_part_size, math.ceil(size / MAX_COMPOSE_COMPONENTS))
+        token = uuid.uuid4().hex
+
+        parts = [
+            blob.bucket.blob(f"{blob.name}.gchelper-part-{token}-{index:02d}")
+            for index in range(math.ceil(size / part_size))]
+        try:
+            futures = [
+                part_executor.submit(self._upload_part, file_name, part, index * part_size,
+                    min(part_size, size - index * part_size))
+                for index, part in enumerate(parts)]
+
+            wait(futures)
+            for future in futures:
+                # re-raise the first part failure
+                future.result()
+
+            blob.content_type = blob.content_type or mimetypes.guess_type(file_name)[0]
+            blob.compose(parts)
+
+        finally:
+            blob.bucket.delete_blobs(parts, on_error=lambda part: None)
+
+    def _upload_part(self,
+        file_name : str,
+        part : Blob,
+        offset : int,
+        length : int
+        ):
+
+        with open(file_name, 'rb') as f:
+            f.seek(offset)
+            part.upload_from_file(f, size=length)
+
+    #endregion
+
+
+class _BufferWriter:
+    '''
+    Minimal file object copying the downloaded chunks into a memoryview.
+    '''
+
+    def __init__(self, view : memoryview):
+        self.view = view
+        self.position = 0
+
+    def write(self, data) -> int:
+        length = len(data)
+        self.view[self.position:self.position + length] = data
+        self.position += length
+        return length
+
+    def tell(self) -> int:
+        return self.position
@@ -0,0 +1,135 @@
+import base64
+import logging
+import sqlite3
+import threading
+
+from google.api_core import exceptions
+from google.cloud import storage
+from google.cloud.storage.blob import Blob
+
+from ..storage.paths import split_gcs_path
+
+logger = logging.getLogger(__name__)
+
+# OCR cache fields to request when listing the images
+CACHE_LIST_FIELDS = ('name', 'generation', 'size', 'md5Hash', 'crc32c')
+
+# SQLite commits are grouped, an fsync per image would dominate
+COMMIT_INTERVAL = 100
+
+def cache_key(blob : Blob) -> str:
+    '''
+    Returns the content key of a listed blob: its MD5, or for composite
+    objects (which have none) its CRC32C and size. None without hashes.
+    '''
+
+    if blob.md5_hash:
+        return base64.b64decode(blob.md5_hash).hex()
+    if blob.crc32c:
+        # a 32-bit checksum alone would collide across a large corpus
+        return f"crc32c-{base64.b64decode(blob.crc32c).hex()}-{blob.size}"
+
+    return None
+
+def open_ocr_cache(path : str, storage_client : storage.Client = None):
+    '''
+    Returns a GcsOcrCache for gs://bucket/prefix paths, otherwise a SqliteOcrCache.
+    '''
+
+    if path.startswith('gs://'):
+        bucket_name, prefix = split_gcs_path(path)
+        return GcsOcrCache(storage_client, bucket_name, prefix)
+
+    return SqliteOcrCache(path)
+
+
+class SqliteOcrCache:
+    '''
+    OCR texts keyed by image content in a local SQLite file. Thread-safe.
+    An empty text records an image without text.
+    '''
+
+    def __init__(self, path : str):
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS ocr (key TEXT PRIMARY KEY, text TEXT NOT NULL)')
+        self._connection.commit()
+
+    def get(self, key : str) -> str:
+        '''
+        Returns the cached text, None on a miss.
+        '''
+
+        with self._lock:
+            row = self._connection.execute('SELECT text FROM ocr WHERE key = ?', (key,)).fetchone()
+
+        return row[0] if row else None
+
+    def put(self, key : str, text : str):
+
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO ocr (key, text) VALUES (?, ?)', (key, text or ''))
+            self._uncommitted += 1
+            if self._uncommitted >= COMMIT_INTERVAL:
+                self._connection.commit()
+                self._uncommitted = 0
+
+    def close(self):
+
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+
+class GcsOcrCache:
+    '''
+    OCR texts keyed by image content, one object per key under a GCS prefix,
+    shareable between machines. The keys are listed once, so misses cost no request.
+    '''
+
+    def __init__(self,
+        storage_client : storage.Client,
+        bucket_name : str,
+        prefix : str = ''
+        ):
+
+        self.bucket = storage_client.bucket(bucket_name)
+        self.prefix = prefix if not prefix or prefix.endswith('/') else f"{prefix}/"
+        self._lock = threading.Lock()
+        self._keys = None
+
+    def get(self, key : str) -> str:
+        '''
+        Returns the cached text, None on a miss.
+        '''
+
+        with self._lock:
+            if self._keys is None:
+                self._keys = set(
+                    blob.name[len(self.prefix):]
+                    for blob in self.bucket.client.list_blobs(self.bucket, prefix=self.prefix, fields='items(name),nextPageToken'))
+                logger.info(f"OCR cache gs://{self.bucket.name}/{self.prefix}: {len(self._keys)} entries")
+
+            if key not in self._keys:
+                return None
+
+        try:
+            return self.bucket.blob(f"{self.prefix}{key}").download_as_bytes().decode('utf-8')
+        except exceptions.NotFound:
+            return None
+
+    def put(self, key : str, text : str):
+
+        self.bucket.blob(f"{self.prefix}{key}").upload_from_string(
+            (text or '').encode('utf-8'), content_type='text/plain; charset=utf-8')
+
+        with self._lock:
+            if self._keys is not None:
+                self._keys.add(key)
+
+    def close(self):
+        pass
@@ -0,0 +1,129 @@
+import json
+import logging
+import os
+import threading
+
+from typing import Callable, Dict, Iterable, Iterator
+
+from google.cloud import storage
+from google.cloud.storage.blob import Blob
+
+from ..storage.paths import split_gcs_path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAVE_INTERVAL = 1000
+
+class OcrCheckpoint:
+    '''
+    Manifest of the images already processed by an OCR run, keyed by blob name
+    and generation, kept in a local JSON file or in a gs:// object.
+
+    A rerun skips the images whose generation did not change, so a crashed or
+    nightly run only annotates new and overwritten images. Only successful
+    results are recorded: failed images are retried on the next run.
+    '''
+
+    def __init__(self,
+        path : str,
+        storage_client : storage.Client = None,
+        save_interval : int = DEFAULT_SAVE_INTERVAL,
+        before_save : Callable[[], None] = None
+        ):
+        '''
+        path: local file name or gs://bucket/name, the latter requires storage_client.
+        save_interval: the manifest is saved every save_interval processed images.
+        before_save: called before each save, e.g. to flush buffered results.
+        '''
+
+        self.path = path
+        self.storage_client = storage_client
+        self.save_interval = save_interval
+        self.before_save = before_save
+
+        self.entries : Dict[str, int] = {}
+        self.skipped = 0
+        self._pending : Dict[str, int] = {}
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        # saves are serialized, the entries lock is only held to take a snapshot
+        self._save_lock = threading.Lock()
+
+        self._load()
+
+    def filter(self, blobs : Iterable[Blob]) -> Iterator[Blob]:
+        '''
+        Yields the blobs not processed yet or modified since. The blobs must
+        be listed with their generation.
+        '''
+
+        for blob in blobs:
+            with self._lock:
+                if self.entries.get(blob.name) == blob.generation:
+                    self.skipped += 1
+                    continue
+                self._pending[blob.name] = blob.generation
+
+            yield blob
+
+    def mark_done(self, blob_name : str):
+        '''
+        Records a blob yielded by filter as processed, saving the manifest every save_interval calls.
+        '''
+
+        with self._lock:
+            generation = self._pending.pop(blob_name, None)
+            if generation is None:
+                return
+
+            self.entries[blob_name] = generation
+            self._unsaved += 1
+            if self._unsaved < self.save_interval:
+                return
+
+        self.save()
+
+    def save(self):
+
+        with self._save_lock:
+            # entries are taken first: all of them were written before the flush
+            with self._lock:
+                data = json.dumps(self.entries)
+                self._unsaved = 0
+
+            if self.before_save:
+                self.before_save()
+
+            if self.path.startswith('gs://'):
+                self._gcs_blob().upload_from_string(data, content_type='application/json')
+            else:
+                temp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(temp_path, 'w') as f:
+                    f.write(data)
+                os.replace(temp_path, self.path)
+
+        logger.debug(f"OCR checkpoint saved to {self.path} ({len(self.entries)} images)")
+
+    def _load(self):
+
+        data = None
+        if self.path.startswith('gs://'):
+            blob = self._gcs_blob()
+            if blob.exists():
+                data = blob.download_as_bytes()
+        elif os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                data = f.read()
+
+        if data:
+            try:
+                self.entries = json.loads(data)
+            except ValueError:
+                logger.warning(f"Ignoring corrupt OCR checkpoint {self.path}")
+
+        logger.info(f"OCR checkpoint {self.path}: {len(self.entries)} images already processed")
+
+    def _gcs_blob(self) -> Blob:
+
+        bucket_name, blob_name = split_gcs_path(self.path)
+        return self.storage_client.bucket(bucket_name).blob(blob_name)
@@ -1,64 +1,573 @@
+import json
 import logging
 import os
+import re
+import threading
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional
 
 from google.cloud import vision, storage
+from google.cloud.storage.blob import Blob
 
 from ..storage.blobs import Blobs
 from ..storage.buckets import Buckets
+from ..storage.concurrency import batched, bounded_map
+from ..storage.paths import split_gcs_path
+from ..storage.retry import RetryPolicy
+from .cache import CACHE_LIST_FIELDS, cache_key, open_ocr_cache
+from .checkpoint import OcrCheckpoint, DEFAULT_SAVE_INTERVAL
+from .pipeline import OcrPipeline, OcrProgress, DEFAULT_REQUESTS_PER_MINUTE
+from .preprocess import ImagePreprocessor
+from .sinks import DirectorySink
 
 logger = logging.getLogger(__name__)
 
+# Vision accepts at most 16 images per batch_annotate_images request.
+MAX_BATCH_SIZE = 16
+
+# Documents annotated by async_batch_annotate_files, by extension.
+FILE_MIME_TYPES = {
+    '.pdf': 'application/pdf',
+    '.tif': 'image/tiff',
+    '.tiff': 'image/tiff',
+    '.gif': 'image/gif'
+}
+
+# Images sent as content are split over several requests above this size,
+# the JSON request limit being 10 MB once base64-encoded.
+MAX_REQUEST_CONTENT_SIZE = 7 * 1024 * 1024
+
+DEFAULT_FILES_PER_OPERATION = 20
+DEFAULT_PAGES_PER_SHARD = 20
+
+class OcrResult(NamedTuple):
+    '''
+    OCR outcome of one image. text is None when no text was found or on error.
+    boxes holds the words found with their vertices, for images annotated by this run.
+    '''
+    blob_name : str
+    text : str = None
+    error : Exception = None
+    boxes : list = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
 class OCR:
 
-    def __init__(self, 
+    def __init__(self,
         service_acct : str,
         project_id : str,
-        region : str = 'us-central1'
+        region : str = 'us-central1',
+        preprocessor : ImagePreprocessor = None
         ):
+        '''
+        preprocessor: when set, images are downloaded, downscaled and sent to
+            Vision as content instead of by URI, see ImagePreprocessor.
+        '''
 
         logger.info(f"Create OCR client for project {project_id} in region {region}")
-        
+
         self.project_id = project_id
         self.region = region
-        
+
         self.vision_client = vision.ImageAnnotatorClient.from_service_account_file(service_acct)
-        
+
         self.storage_client = storage.Client.from_service_account_json(service_acct)
         self.bucketsHelper = Buckets(self.storage_client, region=region)
         self.blobsHelper = Blobs(self.storage_client)
 
+        # throttled (429) and unavailable Vision calls are retried with backoff
+        self.retry_policy = RetryPolicy()
+
+        self.preprocessor = preprocessor
 
     def run_ocr(self,
-        source_bucket : str, 
+        source_bucket : str,
         source_prefix : str,
-        temp_directory : str = './tmp'
-        ):
+        temp_directory : str = './tmp',
+        batch_size : int = None,
+        max_concurrent_batches : int = 4,
+        pipelined : bool = False,
+        requests_per_minute : float = DEFAULT_REQUESTS_PER_MINUTE,
+        progress_callback : Callable[[OcrProgress], None] = None,
+        checkpoint_path : str = None,
+        checkpoint_interval : int = DEFAULT_SAVE_INTERVAL,
+        cache_path : str = None,
+        sink = None
+        ) -> Optional[OcrProgress]:
+        '''
+        Writes the text found in the .png blobs under source_prefix to sink,
+        by default a DirectorySink writing .txt files to temp_directory.
+
+        sink: where the results go, e.g. JsonlSink. It is flushed before each
+            checkpoint save and at the end, and left open for the caller to close.
+
+        batch_size: when set, images are sent batch_size (at most 16) per
+            batch_annotate_images request, with max_concurrent_batches requests
+            in flight. Otherwise one text_detection request per image.
+        pipelined: list, annotate and write in concurrent stages (see OcrPipeline),
+            max_concurrent_batches annotation workers held to requests_per_minute
+            images, progress_callback receiving OcrProgress counters periodically.
+            Returns the final OcrProgress; the other modes return None.
+        checkpoint_path: local file or gs:// manifest of the processed images
+            (see OcrCheckpoint), saved every checkpoint_interval images. A rerun
+            only annotates the images added or overwritten since.
+        cache_path: SQLite file or gs:// prefix of OCR texts keyed by image
+            content (MD5 from the listing). Images already in the cache and
+            duplicates within the run are not sent to Vision.
+        '''
 
         logger.info(f"source:{source_bucket}/{source_prefix} temp:{temp_directory}")
-        
-        # get source blobs (png files)
-        blobs = self.blobsHelper.list_blobs(source_bucket, prefix=source_prefix)
-        #blobs = self.storage_client.list_blobs(source_bucket, prefix=source_prefix)
 
-        image = vision.Image()
+        sink = sink or DirectorySink(temp_directory)
+
+        checkpoint = None
+        fields = ('name',)
+        if checkpoint_path:
+            # buffered results must be durable before the checkpoint claims them
+            checkpoint = OcrCheckpoint(checkpoint_path, self.storage_client, checkpoint_interval,
+                before_save=sink.flush)
+            fields = ('name', 'generation')
+
+        cached_results = None
+        if cache_path:
+            fields = CACHE_LIST_FIELDS
+
+        # get source blobs (png files), page by page while the listing goes on
+        blobs = self.blobsHelper.iter_blobs(source_bucket, prefix=source_prefix, fields=fields)
+        png_blobs = (blob for blob in blobs if blob.name.endswith(".png"))
+        if checkpoint:
+            png_blobs = checkpoint.filter(png_blobs)
+
+        def write(result : OcrResult):
+            sink.write(result)
+            if checkpoint and result.succeeded:
+                checkpoint.mark_done(result.blob_name)
+
+        if cache_path:
+            cached_results = _CachedResults(open_ocr_cache(cache_path, self.storage_client), write)
+            png_blobs = cached_results.filter(png_blobs)
+            write = cached_results.write
+
+        try:
+            if pipelined:
+                pipeline = OcrPipeline(
+                    annotate=lambda batch: self._annotate_batch(source_bucket, batch),
+                    write=write,
+                    batch_size=min(batch_size or MAX_BATCH_SIZE, MAX_BATCH_SIZE),
+                    workers=max_concurrent_batches,
+                    requests_per_minute=requests_per_minute,
+                    progress_callback=progress_callback)
+                if cached_results:
+                    # hits found by the listing thread go through the writer stage too
+                    cached_results.write_hit = pipeline.put_result
+                progress = pipeline.run(png_blobs)
+
+                logger.info(f"OCR done: {progress.annotated} images annotated, {progress.failed} failed, "
+                    f"{progress.cached} from the cache in {progress.elapsed:.1f}s ({progress.images_per_second:.1f} images/s)")
+                return progress
+
+            if batch_size:
+                results = self.annotate_images(source_bucket, png_blobs,
+                    batch_size=batch_size,
+                    max_concurrent_batches=max_concurrent_batches)
+            else:
+                results = (self._detect_text(source_bucket, blob) for blob in png_blobs)
+
+            for result in results:
+                write(result)
+
+        finally:
+            sink.flush()
+            # saved even when the run fails, the rerun resumes from here
+            if checkpoint:
+                checkpoint.save()
+                logger.info(f"{checkpoint.skipped} images skipped, already processed")
+            if cached_results:
+                cached_results.cache.close()
+                logger.info(f"{cached_results.hits} images served from the OCR cache")
+
+        return None
+
+    def run_file_ocr(self,
+        source_bucket : str,
+        source_prefix : str,
+        output_uri : str,
+        temp_directory : str = './tmp',
+        files_per_operation : int = DEFAULT_FILES_PER_OPERATION,
+        pages_per_shard : int = DEFAULT_PAGES_PER_SHARD,
+        max_concurrent_operations : int = 4,
+        timeout : float = None,
+        sink = None
+        ):
+        '''
+        Writes the text of the PDF and TIFF documents under source_prefix to
+        sink, by default one .txt per document in temp_directory, see annotate_files.
+
+        output_uri: gs:// prefix receiving the JSON output of Vision.
+        '''
+
+        sink = sink or DirectorySink(temp_directory)
+
+        logger.info(f"source:{source_bucket}/{source_prefix} output:{output_uri} temp:{temp_directory}")
+
+        blobs = self.blobsHelper.iter_blobs(source_bucket, prefix=source_prefix, fields=('name',))
+        documents = (blob for blob in blobs if os.path.splitext(blob.name)[1].lower() in FILE_MIME_TYPES)
+
+        results = self.annotate_files(source_bucket, documents, output_uri,
+            files_per_operation=files_per_operation,
+            pages_per_shard=pages_per_shard,
+            max_concurrent_operations=max_concurrent_operations,
+            timeout=timeout)
+
+        try:
+            for result in results:
+                sink.write(result)
+        finally:
+            sink.flush()
+
+    def iter_ocr(self,
+        source_bucket : str,
+        source_prefix : str,
+        batch_size : int = MAX_BATCH_SIZE,
+        max_concurrent_batches : int = 4
+        ) -> Iterator[OcrResult]:
+        '''
+        Generator counterpart of run_ocr: yields the OcrResult of the .png blobs under source_prefix.
+        '''
+
+        blobs = self.blobsHelper.iter_blobs(source_bucket, prefix=source_prefix, fields=('name',))
+        png_blobs = (blob for blob in blobs if blob.name.endswith(".png"))
+
+        yield from self.annotate_images(source_bucket, png_blobs,
+            batch_size=batch_size,
+            max_concurrent_batches=max_concurrent_batches)
+
+    def annotate_images(self,
+        bucket_name : str,
+        blobs : Iterable[Blob],
+        batch_size : int = MAX_BATCH_SIZE,
+        max_concurrent_batches : int = 4
+        ) -> Iterator[OcrResult]:
+        """Runs text detection over images with batched requests, several batches in flight.
+
+        Args:
+            blobs: the images, consumed lazily.
+        Returns:
+            a generator of OcrResult in the order of blobs.
+        """
+
+        batches = batched(blobs, min(batch_size, MAX_BATCH_SIZE))
+
+        with ThreadPoolExecutor(max_workers=max_concurrent_batches) as executor:
+            for batch_results in bounded_map(executor, 
+                    lambda batch: self._annotate_batch(bucket_name, batch), batches, 2 * max_concurrent_batches):
+                yield from batch_results
+
+    def annotate_files(self,
+        bucket_name : str,
+        blobs : Iterable[Blob],
+        output_uri : str,
+        files_per_operation : int = DEFAULT_FILES_PER_OPERATION,
+        pages_per_shard : int = DEFAULT_PAGES_PER_SHARD,
+        max_concurrent_operations : int = 4,
+        timeout : float = None
+        ) -> Iterator[OcrResult]:
+        """Runs document text detection over PDF/TIFF files with async_batch_annotate_files.
+
+        Vision rasterizes the pages itself and writes its output as JSON shards of
+        pages_per_shard pages under output_uri/<blob name>/. Each long-running
+        operation covers files_per_operation documents, with max_concurrent_operations
+        operations in flight. The shards of a document are read back in page order.
+
+        Args:
+            blobs: the documents, consumed lazily.
+            timeout: seconds to wait for one operation, None waits forever.
+        Returns:
+            a generator of OcrResult, one per document with the text of all its pages.
+        """
+
+        output_uri = output_uri.rstrip('/')
+
+        in_flight = deque()
+        for batch in batched(blobs, files_per_operation):
+            if len(in_flight) >= max_concurrent_operations:
+                yield from self._file_results(bucket_name, output_uri, *in_flight.popleft(), timeout)
+            in_flight.append((batch, self._submit_files(bucket_name, batch, output_uri, pages_per_shard)))
+
+        while in_flight:
+            yield from self._file_results(bucket_name, output_uri, *in_flight.popleft(), timeout)
+
+    def _submit_files(self,
+        bucket_name : str,
+        blobs : List[Blob],
+        output_uri : str,
+        pages_per_shard : int
+        ):
+        '''
+        Starts the operation annotating blobs; returns it, or the exception raised.
+        '''
+
+        requests = [
+            vision.AsyncAnnotateFileRequest(
+                input_config=vision.InputConfig(
+                    gcs_source=vision.GcsSource(uri=f"gs://{bucket_name}/{blob.name}"),
+                    mime_type=FILE_MIME_TYPES[os.path.splitext(blob.name)[1].lower()]),
+                features=[vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)],
+                output_config=vision.OutputConfig(
+                    gcs_destination=vision.GcsDestination(uri=f"{output_uri}/{blob.name}/"),
+                    batch_size=pages_per_shard))
+            for blob in blobs]
+
+        try:
+            operation = self.retry_policy.call(self.vision_client.async_batch_annotate_files, requests=requests)
+            logger.info(f"Started OCR operation {operation.operation.name} for {len(blobs)} documents")
+            return operation
+
+        except Exception as e:
+            logger.exception(f"OCR failed for a batch of {len(blobs)} documents")
+            return e
+
+    def _file_results(self,
+        bucket_name : str,
+        output_uri : str,
+        blobs : List[Blob],
+        operation,
+        timeout : float
+        ) -> Iterator[OcrResult]:
+
+        if not isinstance(operation, Exception):
+            try:
+                operation.result(timeout=timeout)
+                operation = None
+            except Exception as e:
+                logger.exception(f"OCR operation failed for a batch of {len(blobs)} documents")
+                operation = e
+
+        for blob in blobs:
+            if operation is not None:
+                yield OcrResult(blob.name, error=operation)
+                continue
+
+            try:
+                yield OcrResult(blob.name, self._read_file_output(f"{output_uri}/{blob.name}/") or None)
+            except Exception as e:
+                logger.exception(f"Could not read the OCR output of {blob.name}")
+                yield OcrResult(blob.name, error=e)
+
+    def _read_file_output(self,
+        document_uri : str
+        ) -> str:
+        '''
+        Returns the text of a document from its output shards, read one at a time in page order.
+        '''
+
+        bucket_name, prefix = split_gcs_path(document_uri)
+        shards = list(self.blobsHelper.iter_blobs(bucket_name, prefix=prefix, fields=('name',)))
+        if not shards:
+            raise RuntimeError(f"No OCR output under {document_uri}")
+
+        # output-1-to-20.json, output-21-to-40.json, ...: sorted on the first page
+        shards.sort(key=lambda blob: int(re.search(r"output-(\d+)-to-\d+\.json$", blob.name).group(1)))
+
+        pages = list()
+        for shard in shards:
+            output = json.loads(self.blobsHelper.download_as_bytes(bucket_name, shard.name, reload=False))
+            for response in output.get('responses', []):
+                if 'error' in response:
+                    logger.warning(f"OCR failed for page {response.get('context', {}).get('pageNumber')} "
+                        f"of {document_uri}: {response['error'].get('message')}")
+                    continue
+                pages.append(response.get('fullTextAnnotation', {}).get('text', ''))
+
+        return ''.join(pages)
+
+    def _annotate_batch(self,
+        bucket_name : str,
+        blobs : List[Blob]
+        ) -> List[OcrResult]:
+
+        try:
+            responses = list()
+            for images in self._request_groups(self._images(bucket_name, blobs)):
+                requests = [
+                    vision.AnnotateImageRequest(
+                        image=image,
+                        features=[vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)])
+                    for image in images]
+
+                response = self.retry_policy.call(self.vision_client.batch_annotate_images, requests=requests)
+                responses.extend(response.responses)
+
+        except Exception as e:
+            logger.exception(f"OCR failed for a batch of {len(blobs)} images")
+            return [OcrResult(blob.name, error=e) for blob in blobs]
+
+        # responses come in the order of the requests
+        return [
+            self._to_result(blob.name, image_response)
+            for blob, image_response in zip(blobs, responses)]
+
+    def _detect_text(self,
+        bucket_name : str,
+        blob : Blob
+        ) -> OcrResult:
+
+        logger.info(f"Processing OCR for {blob.name}.")
+
+        try:
+            image = self._images(bucket_name, [blob])[0]
+            response = self.retry_policy.call(self.vision_client.text_detection, image=image)
+
+        except Exception as e:
+            logger.exception(f"OCR failed for {blob.name}")
+            return OcrResult(blob.name, error=e)
+
+        return self._to_result(blob.name, response)
+
+    def _images(self,
+        bucket_name : str,
+        blobs : List[Blob]
+        ) -> List[vision.Image]:
+        '''
+        Returns the Vision images of blobs: their URI, or their downscaled content with a preprocessor.
+        '''
+
+        if self.preprocessor is None:
+            return [
+                vision.Image(source=vision.ImageSource(image_uri=f"gs://{bucket_name}/{blob.name}"))
+                for blob in blobs]
+
+        def download(blob):
+            data = self.blobsHelper.download_as_bytes(bucket_name, blob.name, reload=False)
+            if data is None:
+                raise IOError(f"Could not download gs://{bucket_name}/{blob.name}")
+            return data
+
+        # downloads wait on the network, the downscaling runs on the process pool
+        with ThreadPoolExecutor(max_workers=len(blobs)) as executor:
+            images = list(executor.map(download, blobs))
+
+        return [vision.Image(content=content) for content in self.preprocessor.process(images)]
+
+    def _request_groups(self,
+        images : List[vision.Image]
+        ) -> Iterator[List[vision.Image]]:
+        '''
+        Splits images sent as content so that no request goes over MAX_REQUEST_CONTENT_SIZE.
+        '''
+
+        group = list()
+        group_size = 0
+        for image in images:
+            size = len(image.content or b'')
+            if group and group_size + size > MAX_REQUEST_CONTENT_SIZE:
+                yield group
+                group = list()
+                group_size = 0
+
+            group.append(image)
+            group_size += size
+
+        if group:
+            yield group
+
+    def _to_result(self,
+        blob_name : str,
+        response : vision.AnnotateImageResponse
+        ) -> OcrResult:
+
+        if response.error.message:
+            return OcrResult(blob_name, error=RuntimeError(response.error.message))
+
+        if response.text_annotations:
+            # the first annotation is the whole text, the others its words
+            boxes = [
+                {'text': word.description,
+                 'vertices': [[vertex.x, vertex.y] for vertex in word.bounding_poly.vertices]}
+                for word in response.text_annotations[1:]]
+            return OcrResult(blob_name, response.text_annotations[0].description, boxes=boxes)
+
+        return OcrResult(blob_name)
+
+
+class _CachedResults:
+    '''
+    Serves the images whose content is in the OCR cache without calling Vision,
+    and sends only the first of identical images of a run, its result being
+    copied to the others. Fills the cache with the successful results.
+
+    Hits are passed to write_hit when set, e.g. to hand them over to the
+    thread running write, otherwise written from the thread running filter.
+    '''
+
+    def __init__(self, cache, write : Callable[[OcrResult], None]):
+
+        self.cache = cache
+        self.write_result = write
+        self.write_hit = None
+        self.hits = 0
+
+        self._keys = dict()     # name -> content key of the images sent to Vision
+        self._waiting = dict()  # content key -> names of the identical images waiting
+        self._lock = threading.Lock()
+
+    def filter(self, blobs : Iterable[Blob]) -> Iterator[Blob]:
+        '''
+        Yields the images to annotate, writing the results of the others.
+        '''
+
         for blob in blobs:
-            if blob.name.endswith(".png"):
-
-                logger.info(f"Processing OCR for {blob.name}.")
-
-                image.source.image_uri = f"gs://{source_bucket}/{blob.name}"
-                response = self.vision_client.text_detection(image=image)
-
-                if (response and response.text_annotations):
-                    #save text description in temp file
-                    text = response.text_annotations[0].description
-                    temp_txt = os.path.join(
-                        temp_directory, os.path.basename(blob.name).replace(".png", ".txt"))
-
-                    with open(temp_txt, "w") as f:
-                        f.write(text)
-                        f.close()
-        
-                else:
-                    logger.warn(f'OCR faild for {blob.name}')
-        
\ No newline at end of file
+            key = cache_key(blob)
+            if key is None:
+                yield blob
+                continue
+
+            with self._lock:
+                if key in self._waiting:
+                    self._waiting[key].append(blob.name)
+                    self.hits += 1
+                    continue
+
+            try:
+                text = self.cache.get(key)
+            except Exception:
+                logger.exception(f"OCR cache lookup failed for {blob.name}")
+                text = None
+
+            if text is not None:
+                self.hits += 1
+                (self.write_hit or self.write_result)(OcrResult(blob.name, text or None))
+                continue
+
+            with self._lock:
+                self._waiting[key] = list()
+                self._keys[blob.name] = key
+
+            yield blob
+
+    def write(self, result : OcrResult) -> int:
+        '''
+        Writes result and its duplicates; returns the number of results written.
+        '''
+
+        with self._lock:
+            key = self._keys.pop(result.blob_name, None)
+            duplicates = self._waiting.pop(key, []) if key else []
+
+        if key and result.succeeded:
+            try:
+                self.cache.put(key, result.text)
+            except Exception:
+                logger.exception(f"Could not cache the OCR result of {result.blob_name}")
+
+        self.write_result(result)
+        for blob_name in duplicates:
+            self.write_result(result._replace(blob_name=blob_name))
+
+        return 1 + len(duplicates)
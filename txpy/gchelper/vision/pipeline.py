@@ -0,0 +1,238 @@
+import logging
+import queue
+import threading
+import time
+
+from typing import Callable, Iterable, List, NamedTuple
+
+from google.cloud.storage.blob import Blob
+
+from ..storage.concurrency import batched
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REQUESTS_PER_MINUTE = 1800
+
+# end of stream marker passed through the queues
+_DONE = object()
+
+class TokenBucket:
+    '''
+    Thread-safe token bucket refilled at rate_per_minute, holding at most burst tokens.
+
+    A request bigger than the bucket waits for a full bucket and is then
+    charged in full, leaving the bucket in debt, so that the rate holds
+    whatever the request size.
+    '''
+
+    def __init__(self,
+        rate_per_minute : float,
+        burst : float = None
+        ):
+
+        self.rate = rate_per_minute / 60.0
+        self.capacity = burst or max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens : float = 1) -> float:
+        '''
+        Blocks until tokens are available; returns the seconds spent waiting.
+        '''
+
+        # a request bigger than the bucket would never fit, it waits for a full bucket
+        needed = min(tokens, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= needed:
+                    # may go negative: the next requests wait for the debt to be refilled
+                    self.tokens -= tokens
+                    return waited
+
+                wait = (needed - self.tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
+
+
+class OcrProgress(NamedTuple):
+    '''
+    Counters of an OCR pipeline run, passed to the progress callback.
+    '''
+    listed : int = 0
+    annotated : int = 0
+    failed : int = 0
+    cached : int = 0
+    written : int = 0
+    requests : int = 0
+    throttled_seconds : float = 0.0
+    elapsed : float = 0.0
+
+    @property
+    def images_per_second(self) -> float:
+        return self.annotated / self.elapsed if self.elapsed else 0.0
+
+
+class OcrPipeline:
+    '''
+    Three-stage OCR pipeline: a listing thread fills a bounded queue of image
+    batches, workers annotate them under a token bucket matching the Vision
+    quota, and the calling thread writes the results.
+
+    Bounded queues give backpressure: a slow writer stalls the workers, and
+    stalled workers stall the listing.
+    '''
+
+    def __init__(self,
+        annotate : Callable[[List[Blob]], list],
+        write : Callable,
+        batch_size : int = 16,
+        workers : int = 4,
+        requests_per_minute : float = DEFAULT_REQUESTS_PER_MINUTE,
+        queue_size : int = None,
+        progress_callback : Callable[[OcrProgress], None] = None,
+        progress_interval : float = 10.0
+        ):
+        '''
+        annotate: turns a batch of blobs into one OcrResult per blob, reporting
+            failures in the results rather than raising.
+        write: persists one OcrResult; may return the number of results it
+            wrote when it writes others along (e.g. duplicates).
+        requests_per_minute: Vision quota; every image of a batch takes one token.
+        '''
+
+        self.annotate = annotate
+        self.write = write
+        self.batch_size = batch_size
+        self.workers = workers
+        self.token_bucket = TokenBucket(requests_per_minute)
+        self.queue_size = queue_size or 2 * workers
+        self.progress_callback = progress_callback
+        self.progress_interval = progress_interval
+
+        self._lock = threading.Lock()
+        self._counters = dict()
+        self._results = None
+
+    def run(self, blobs : Iterable[Blob]) -> OcrProgress:
+        """Runs the pipeline to completion.
+
+        Returns:
+            the final OcrProgress. Listing errors are re-raised once the pipeline drained.
+        """
+
+        self._counters = dict(listed=0, annotated=0, failed=0, cached=0, written=0, requests=0,
+            throttled_seconds=0.0)
+        self._start_time = time.monotonic()
+
+        batches = queue.Queue(maxsize=self.queue_size)
+        results = self._results = queue.Queue(maxsize=self.queue_size)
+        listing_errors = list()
+
+        lister = threading.Thread(target=self._list, args=(blobs, batches, listing_errors), daemon=True)
+        workers = [
+            threading.Thread(target=self._annotate, args=(batches, results), daemon=True)
+            for _ in range(self.workers)]
+
+        lister.start()
+        for worker in workers:
+            worker.start()
+
+        last_progress = time.monotonic()
+        remaining_workers = len(workers)
+        while remaining_workers:
+            batch_results = results.get()
+            if batch_results is _DONE:
+                remaining_workers -= 1
+                continue
+
+            for result in batch_results:
+                try:
+                    written = self.write(result)
+                    self._count(written=1 if written is None else written)
+                except Exception:
+                    logger.exception(f"Could not write the OCR result of {result.blob_name}")
+
+            if self.progress_callback and time.monotonic() - last_progress >= self.progress_interval:
+                self.progress_callback(self.progress())
+                last_progress = time.monotonic()
+
+        lister.join()
+        for worker in workers:
+            worker.join()
+
+        progress = self.progress()
+        if self.progress_callback:
+            self.progress_callback(progress)
+
+        if listing_errors:
+            raise listing_errors[0]
+
+        return progress
+
+    def put_result(self, result):
+        '''
+        Hands a result obtained without annotation (e.g. a cache hit) to the
+        writer stage. Only valid from the listing thread while run is going on.
+        '''
+
+        self._count(cached=1)
+        self._results.put([result])
+
+    def progress(self) -> OcrProgress:
+
+        with self._lock:
+            return OcrProgress(elapsed=time.monotonic() - self._start_time, **self._counters)
+
+    def _list(self,
+        blobs : Iterable[Blob],
+        batches : queue.Queue,
+        listing_errors : list
+        ):
+
+        try:
+            for batch in batched(blobs, self.batch_size):
+                self._count(listed=len(batch))
+                batches.put(batch)
+
+        except Exception as e:
+            logger.exception("Listing failed, stopping the pipeline")
+            listing_errors.append(e)
+
+        finally:
+            for _ in range(self.workers):
+                batches.put(_DONE)
+
+    def _annotate(self,
+        batches : queue.Queue,
+        results : queue.Queue
+        ):
+
+        try:
+            while True:
+                batch = batches.get()
+                if batch is _DONE:
+                    break
+
+                throttled = self.token_bucket.acquire(len(batch))
+                batch_results = self.annotate(batch)
+
+                failed = sum(1 for result in batch_results if not result.succeeded)
+                self._count(annotated=len(batch_results) - failed, failed=failed, requests=1,
+                    throttled_seconds=throttled)
+                results.put(batch_results)
+
+        finally:
+            results.put(_DONE)
+
+    def _count(self, **increments):
+
+        with self._lock:
+            for name, increment in increments.items():
+                self._counters[name] += increment
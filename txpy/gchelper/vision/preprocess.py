@@ -0,0 +1,126 @@
+import io
+import logging
+import multiprocessing
+import os
+import threading
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+try:
+    from PIL import Image
+except ImportError: # optional, pip install txpy-gchelper[images]
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# About 300 dpi on a letter or A4 page, plenty for text detection.
+DEFAULT_MAX_LONG_EDGE = 3300
+
+JPEG = 'JPEG'
+PNG = 'PNG'
+
+def downscale_image(
+    data : bytes,
+    max_long_edge : int = DEFAULT_MAX_LONG_EDGE,
+    target_dpi : int = None,
+    image_format : str = JPEG,
+    quality : int = 85,
+    grayscale : bool = True
+    ) -> bytes:
+    '''
+    Downscales an encoded image to target_dpi (when its resolution is known)
+    and to at most max_long_edge pixels, then re-encodes it. Returns data
+    unchanged when that would not make it smaller.
+    '''
+
+    image = Image.open(io.BytesIO(data))
+    width, height = image.size
+
+    scale = min(1.0, max_long_edge / max(width, height))
+    dpi = image.info.get('dpi')
+    if target_dpi and dpi and dpi[0]:
+        scale = min(scale, target_dpi / float(dpi[0]))
+
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    mode = 'L' if grayscale else 'RGB'
+
+    # lets the JPEG decoder itself shrink by 1/2, 1/4 or 1/8, no-op for other formats
+    image.draft(mode, size)
+    image = image.convert(mode)
+    if image.size != size:
+        image = image.resize(size, Image.LANCZOS)
+
+    output = io.BytesIO()
+    if image_format == JPEG:
+        image.save(output, JPEG, quality=quality, optimize=True)
+    else:
+        image.save(output, image_format, optimize=True)
+
+    encoded = output.getvalue()
+    return encoded if len(encoded) < len(data) else data
+
+
+class ImagePreprocessor:
+    '''
+    Shrinks images on a process pool before they are sent to Vision as
+    content, see downscale_image. Requires Pillow.
+
+    The workers are spawned, not forked, so scripts using it need the usual
+    if __name__ == '__main__' guard.
+    '''
+
+    def __init__(self,
+        max_long_edge : int = DEFAULT_MAX_LONG_EDGE,
+        target_dpi : int = None,
+        image_format : str = JPEG,
+        quality : int = 85,
+        grayscale : bool = True,
+        max_workers : int = None
+        ):
+        '''
+        max_workers: processes, os.cpu_count() by default.
+        '''
+
+        if Image is None:
+            raise ImportError("Image preprocessing requires the Pillow package")
+
+        self.max_long_edge = max_long_edge
+        self.target_dpi = target_dpi
+        self.image_format = image_format
+        self.quality = quality
+        self.grayscale = grayscale
+        self.max_workers = max_workers or os.cpu_count()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def process(self, images : List[bytes]) -> List[bytes]:
+        '''
+        Returns the downscaled images, in order.
+        '''
+
+        with self._lock:
+            if self._executor is None:
+                # forking a process running gRPC and thread pools can deadlock the children
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'))
+
+        futures = [
+            self._executor.submit(downscale_image, data, self.max_long_edge, self.target_dpi,
+                self.image_format, self.quality, self.grayscale)
+            for data in images]
+
+        return [future.result() for future in futures]
+
+    def close(self):
+
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,146 @@
+import logging
+import os
+import posixpath
+import threading
+import time
+
+from typing import IO, List
+
+from ..storage.blobs import Blobs, DEFAULT_WRITE_CHUNK_SIZE
+from ..storage.jsonl import encode_jsonl_line
+from ..storage.paths import split_gcs_path
+
+logger = logging.getLogger(__name__)
+
+class DirectorySink:
+    '''
+    Writes the text of every image to <directory>/<image name>.txt.
+    '''
+
+    def __init__(self, directory : str):
+
+        self.directory = directory
+
+    def write(self, result):
+
+        if result.text:
+            #save text description in temp file
+            temp_txt = os.path.join(
+                self.directory, os.path.splitext(os.path.basename(result.blob_name))[0] + ".txt")
+
+            with open(temp_txt, "w") as f:
+                f.write(result.text)
+
+        else:
+            logger.warning(f'OCR failed for {result.blob_name}')
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class JsonlSink:
+    '''
+    Appends the results to sharded JSONL files in GCS, one record
+    {"name", "text"[, "boxes"]} per image, streamed through resumable uploads
+    in chunks of chunk_size. Thread-safe.
+
+    gs://b/ocr.jsonl becomes gs://b/ocr-<run id>-00000.jsonl, ...: a shard is
+    finalized when it reaches max_shard_size bytes, on flush and on close, so
+    reruns never overwrite the shards of earlier runs.
+    '''
+
+    def __init__(self,
+        blobs : Blobs,
+        full_gcs_path : str,
+        include_bounding_boxes : bool = False,
+        max_shard_size : int = 256 * 1024 * 1024,
+        chunk_size : int = DEFAULT_WRITE_CHUNK_SIZE,
+        codec : str = None,
+        run_id : str = None
+        ):
+        '''
+        include_bounding_boxes: adds the words of each image with their vertices,
+            [{"text": ..., "vertices": [[x, y], ...]}, ...].
+        codec: 'gzip' or 'zstd' to store the shards compressed.
+        '''
+
+        self.blobs = blobs
+        self.include_bounding_boxes = include_bounding_boxes
+        self.max_shard_size = max_shard_size
+        self.chunk_size = chunk_size
+        self.codec = codec
+        self.run_id = run_id or time.strftime('%Y%m%dT%H%M%S', time.gmtime())
+        self.paths : List[str] = list()
+
+        self.bucket_name, blob_name = split_gcs_path(full_gcs_path)
+        self._root, self._extension = posixpath.splitext(blob_name)
+        self._writer : IO[bytes] = None
+        self._shard_size = 0
+        self._lock = threading.Lock()
+
+    def write(self, result):
+
+        if not result.succeeded:
+            logger.warning(f'OCR failed for {result.blob_name}')
+            return
+
+        record = {'name': result.blob_name, 'text': result.text or ''}
+        if self.include_bounding_boxes:
+            record['boxes'] = result.boxes or []
+        line = encode_jsonl_line(record)
+
+        with self._lock:
+            if self._writer is not None and self._shard_size + len(line) > self.max_shard_size:
+                self._close_shard()
+
+            if self._writer is None:
+                self._open_shard()
+
+            self._writer.write(line)
+            self._shard_size += len(line)
+
+    def flush(self):
+        '''
+        Finalizes the current shard, making the results written so far durable.
+        '''
+
+        with self._lock:
+            if self._writer is not None:
+                self._close_shard()
+
+    def close(self):
+
+        self.flush()
+        logger.info(f"Saved OCR results to {', '.join(self.paths)}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _open_shard(self):
+
+        name = f"{self._root}-{self.run_id}-{len(self.paths):05d}{self._extension}"
+        self._writer = self.blobs.open_writer(self.bucket_name, name, self.chunk_size,
+            content_type='application/jsonl', codec=self.codec)
+        if self._writer is None:
+            raise IOError(f"Could not open gs://{self.bucket_name}/{name}")
+
+        self.paths.append(f"gs://{self.bucket_name}/{name}")
+        self._shard_size = 0
+
+    def _close_shard(self):
+
+        # closing finalizes the upload
+        writer, self._writer = self._writer, None
+        writer.close()